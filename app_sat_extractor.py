@@ -1,9 +1,2081 @@
+import os
+import sys
+import json
+import heapq
+import argparse
+import subprocess
+import re
+import random
+import queue
+import threading
+import time
+import uuid
+import hashlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
 import pandas as pd
+import numpy as np
 import xml.etree.ElementTree as ET
 from io import BytesIO
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
 from datetime import datetime
 
+NS = {
+    'cfdi': 'http://www.sat.gob.mx/cfd/4',
+    'cfdi3': 'http://www.sat.gob.mx/cfd/3',
+    'tfd': 'http://www.sat.gob.mx/TimbreFiscalDigital',
+    'pago20': 'http://www.sat.gob.mx/Pagos20'
+}
+
+# ============= BACKEND XML (lxml OPCIONAL) =============
+
+try:
+    from lxml import etree as LET
+except ImportError:
+    LET = None
+
+
+def _decode_xml(raw):
+    """Texto del XML como siempre se ha leído: UTF-8, descartando los bytes inválidos"""
+    return raw.decode('utf-8', errors='ignore')
+
+
+class EtreeBackend:
+    """Backend con la librería estándar (xml.etree.ElementTree).
+
+    Acepta texto o bytes; los bytes se parsean directo y solo si no son XML válido se
+    decodifican y se reintenta, para no copiar el archivo en cada parseo.
+    """
+
+    name = 'etree'
+    # Parseo y recorrido en Python: varios hilos solo se turnan el GIL
+    releases_gil = False
+
+    def fromstring(self, xml_text):
+        if isinstance(xml_text, str):
+            return ET.fromstring(xml_text)
+        try:
+            return ET.fromstring(xml_text)
+        except ET.ParseError:
+            return ET.fromstring(_decode_xml(xml_text))
+
+    def select_code(self, compiler, path, elem, first):
+        """Código que elige los nodos de una ruta (el primero o None si first).
+
+        find/findall con una sola etiqueta '{uri}nombre' y sin mapa de namespaces corren en C;
+        las rutas de varios pasos encadenan findall y las de descendientes usan iter().
+        """
+        if path.descendant:
+            nodes = f"_descendants({elem}, {compiler.literal(path)}, {first})"
+        elif len(path.steps) == 1:
+            return f"{elem}.{'find' if first else 'findall'}({path.steps[0]!r})"
+        else:
+            nodes = f"_follow({elem}, {compiler.literal(path.steps)})"
+        return f"_first({nodes})" if first else nodes
+
+    def compile_paths(self, xpaths):
+        return {}
+
+
+class LxmlBackend:
+    """Backend con lxml: parseo en C y rutas de cada scope compiladas una sola vez como XPath.
+
+    Las rutas de los scopes ('a/b' y './/a') significan lo mismo en ElementPath y en XPath,
+    así que ambos backends eligen los mismos nodos; la búsqueda corre en C sin crear un
+    proxy de Python por cada hijo recorrido. Parsers y XPath compilados se guardan por hilo
+    porque lxml no permite compartirlos entre hilos.
+    """
+
+    name = 'lxml'
+    # libxml2 parsea sin el GIL, así que el pool de hilos sí reparte trabajo entre núcleos
+    releases_gil = True
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _parser(self, encoding=None):
+        parsers = getattr(self._local, 'parsers', None)
+        if parsers is None:
+            parsers = self._local.parsers = {}
+        if encoding not in parsers:
+            parsers[encoding] = LET.XMLParser(
+                encoding=encoding, resolve_entities=False, no_network=True, huge_tree=True
+            )
+        return parsers[encoding]
+
+    def fromstring(self, xml_text):
+        # encoding='utf-8': el texto ya viene decodificado, se ignora la declaración del XML
+        if isinstance(xml_text, str):
+            return LET.fromstring(xml_text.encode('utf-8'), self._parser('utf-8'))
+        try:
+            return LET.fromstring(xml_text, self._parser())
+        except LET.XMLSyntaxError:
+            return LET.fromstring(_decode_xml(xml_text).encode('utf-8'), self._parser('utf-8'))
+
+    def select_code(self, compiler, path, elem, first):
+        """Código que elige los nodos de una ruta (el primero o None si first).
+
+        Un solo paso a hijos directos usa iterchildren(tag), que filtra en C sin evaluar XPath;
+        las demás rutas usan su XPath compilado.
+        """
+        if not path.descendant and len(path.steps) == 1:
+            children = f"{elem}.iterchildren({path.steps[0]!r})"
+            return f"next({children}, None)" if first else f"list({children})"
+        xpath = compiler.xpath(path.text)
+        return f"_first({xpath}({elem}))" if first else f"{xpath}({elem})"
+
+    def compile_paths(self, xpaths):
+        return {name: LET.XPath(text, namespaces=NS) for name, text in xpaths.items()}
+
+
+def get_xml_backend(name=None):
+    """Devuelve el backend pedido; por omisión lxml si está instalado.
+
+    SAT_XML_BACKEND=etree fuerza la librería estándar.
+    """
+    name = name or os.environ.get('SAT_XML_BACKEND', '')
+    if name == 'etree' or LET is None:
+        return EtreeBackend()
+    return LxmlBackend()
+
+
+XML = get_xml_backend()
+
+# ============= FECHAS SAT =============
+
+# Solo dígitos ASCII en cada posición: sin signo, espacios ni dígitos Unicode. El año 0000
+# se excluye aquí porque numpy lo acepta y datetime no
+_SAT_DATE_RE = re.compile(r'(?!0000)[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}')
+
+
+def _is_sat_date_shape(value):
+    return isinstance(value, str) and _SAT_DATE_RE.fullmatch(value) is not None
+
+
+def parse_sat_datetime(value):
+    """Decodifica una fecha SAT 'YYYY-MM-DDTHH:MM:SS' sin inferir formato; None si es inválida"""
+    if not _is_sat_date_shape(value):
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def parse_sat_dates(values):
+    """Decodifica en bloque fechas SAT a un arreglo datetime64[s].
+
+    Devuelve (fechas, inválidas): las posiciones con formato incorrecto quedan como NaT y
+    sus índices se listan en inválidas para reportarlas como error.
+    """
+    cleaned = [v if _is_sat_date_shape(v) else 'NaT' for v in values]
+    try:
+        dates = np.array(cleaned, dtype='datetime64[s]')
+    except ValueError:
+        # Forma correcta pero valores imposibles (mes 13, dígitos no numéricos, ...)
+        cleaned = [v if v == 'NaT' or parse_sat_datetime(v) is not None else 'NaT' for v in cleaned]
+        dates = np.array(cleaned, dtype='datetime64[s]')
+    invalid = [idx for idx, v in enumerate(cleaned) if v == 'NaT']
+    return dates, invalid
+
+
+def format_sat_dates(dates):
+    """datetime64[s] -> 'YYYY-MM-DD HH:MM:SS' (None para NaT) sin strftime por elemento"""
+    return [None if text == 'NaT' else text.replace('T', ' ') for text in np.datetime_as_string(dates, unit='s')]
+
+
+def parse_formatted_sat_dates(values):
+    """Inverso de format_sat_dates: vuelve a decodificar con parse_sat_dates (None -> NaT)"""
+    return parse_sat_dates([v.replace(' ', 'T', 1) if isinstance(v, str) else '' for v in values])[0]
+
+
+def parse_emitted_dates(values):
+    """Fechas 'dd/mm/aa' de facturas emitidas -> datetime64[s] (NaT si no se pueden leer)"""
+    dates = pd.to_datetime(pd.Series(values, dtype=object), format='%d/%m/%y', errors='coerce')
+    return dates.to_numpy().astype('datetime64[s]')
+
+# ============= EXTRACCIÓN DECLARATIVA =============
+#
+# Cada tipo de comprobante se describe con un ExtractionSpec: un árbol de Scope (qué nodos
+# leer, con rutas alternativas cfdi/cfdi3/sin namespace) y una lista de columnas que
+# combinan sus atributos. El spec se compila una vez por backend a una función de Python con
+# un bloque por scope que lee los atributos a variables locales y acumula ahí cada columna,
+# como un recorrido escrito a mano. El backend genera la selección de nodos: con etree
+# find/findall con etiquetas '{uri}nombre', que se resuelven en C sin pasar por ElementPath;
+# con lxml cada ruta es un XPath compilado.
+
+
+def _clark(step):
+    """'cfdi:Concepto' -> '{http://www.sat.gob.mx/cfd/4}Concepto'"""
+    prefix, sep, local = step.partition(':')
+    return f"{{{NS[prefix]}}}{local}" if sep else step
+
+
+class _Path:
+    """Ruta relativa al nodo del scope: 'a/b' (hijos directos) o './/a' (descendientes)"""
+
+    def __init__(self, text):
+        self.text = text
+        self.descendant = text.startswith('.//')
+        steps = text[3:] if self.descendant else text
+        self.steps = tuple(_clark(step) for step in steps.split('/'))
+
+
+def _follow(elem, steps):
+    """Nodos que siguen la cadena de etiquetas `steps` desde elem, en orden de documento"""
+    level = [elem]
+    for step in steps:
+        level = [child for node in level for child in node.findall(step)]
+    return level
+
+
+def _descendants(elem, path, first_only):
+    """Equivalente a elem.findall('.//a/b'): iter() recorre el subárbol en C"""
+    found = []
+    for node in elem.iter(path.steps[0]):
+        if node is elem:
+            continue
+        found.extend(_follow(node, path.steps[1:]))
+        if first_only and found:
+            break
+    return found
+
+
+def _first(nodes):
+    return nodes[0] if nodes else None
+
+
+class Attr:
+    """Atributo de texto: elem.get(name, default)"""
+
+    def __init__(self, name, default=''):
+        self.name = name
+        self.default = default
+
+    def code(self, elem):
+        return f"{elem}.get({self.name!r}, {self.default!r})"
+
+
+class Num:
+    """Atributo numérico; con varios nombres usa el primero presente (variantes de escritura)"""
+
+    def __init__(self, *names):
+        self.names = names
+
+    def code(self, elem):
+        reads = ' or '.join(f"{elem}.get({name!r}, '0')" for name in self.names)
+        return f"float({reads} or 0)"
+
+
+class Scope:
+    """Nodo(s) a extraer dentro del scope padre.
+
+    paths son alternativas en orden: se usa la primera que encuentre algún nodo y las
+    siguientes ni se buscan. many=False toma solo el primero; where filtra por atributos
+    antes de leer los campos.
+    """
+
+    def __init__(self, name, paths=(), fields=None, children=(), many=True, where=None):
+        self.name = name
+        self.paths = tuple(_Path(p) for p in paths)
+        self.fields = tuple((fields or {}).items())
+        self.children = tuple(children)
+        self.many = many
+        self.where = tuple((where or {}).items())
+
+
+def _split(path):
+    *scopes, field = path.split('.')
+    return tuple(scopes), field
+
+
+_MISSING = object()
+
+# Columnas: Ref, Sum y Join acumulan un campo de un scope (leaves son esos acumuladores);
+# Const, Coalesce y Computed combinan acumuladores al final. `initial` es el valor antes de
+# la primera instancia y `empty` el de una fila cuyo nivel opcional no tiene instancias.
+
+
+class Ref:
+    """Campo de la primera instancia en la ruta 'scope.subscope.campo'"""
+
+    initial = empty = '_MISSING'
+
+    def __init__(self, path, default=''):
+        self.scopes, self.field = _split(path)
+        self.default = default
+        self.leaves = (self,)
+
+    def update(self, var, value, elem, unique):
+        # Si la ruta no puede tener otra instancia no hace falta ver si ya se asignó
+        if unique:
+            return [f"{var} = {value}"]
+        return [f"if {var} is _MISSING:", f"    {var} = {value}"]
+
+    def result(self, var, literal):
+        return f"({var(self)} if {var(self)} is not _MISSING else {literal(self.default)})"
+
+
+class Sum:
+    """Suma en orden de documento; where=(atributo, valor) filtra los nodos sumados"""
+
+    initial = empty = '0.0'
+
+    def __init__(self, path, where=None):
+        self.scopes, self.field = _split(path)
+        self.where = where
+        self.leaves = (self,)
+
+    def update(self, var, value, elem, unique):
+        if self.where is None:
+            return [f"{var} += {value}"]
+        attr, expected = self.where
+        return [f"if {elem}.get({attr!r}, '') == {expected!r}:", f"    {var} += {value}"]
+
+    def result(self, var, literal):
+        return var(self)
+
+
+class Join:
+    """Concatena los valores no vacíos"""
+
+    initial, empty = '[]', '()'
+
+    def __init__(self, path, sep=' | '):
+        self.scopes, self.field = _split(path)
+        self.sep = sep
+        self.leaves = (self,)
+
+    def update(self, var, value, elem, unique):
+        return [f"if {value}:", f"    {var}.append({value})"]
+
+    def result(self, var, literal):
+        return f"{literal(self.sep)}.join({var(self)})"
+
+
+class Const:
+    leaves = ()
+
+    def __init__(self, value):
+        self.value = value
+
+    def result(self, var, literal):
+        return literal(self.value)
+
+
+class Coalesce:
+    """Primera referencia cuya instancia existe"""
+
+    def __init__(self, *refs):
+        self.refs = [Ref(r, default=_MISSING) for r in refs]
+        self.leaves = tuple(self.refs)
+
+    def result(self, var, literal):
+        chain = ''.join(f"{var(ref)} if {var(ref)} is not _MISSING else " for ref in self.refs)
+        return f"({chain}0.0)"
+
+
+class Computed:
+    """fn aplicada a otras expresiones (formatos y columnas derivadas)"""
+
+    def __init__(self, fn, *exprs):
+        self.fn = fn
+        self.exprs = [Ref(e) if isinstance(e, str) else e for e in exprs]
+        self.leaves = tuple(leaf for e in self.exprs for leaf in e.leaves)
+
+    def result(self, var, literal):
+        args = ', '.join(e.result(var, literal) for e in self.exprs)
+        return f"{literal(self.fn)}({args})"
+
+
+class _SpecCompiler:
+    """Genera el código de la función de extracción de un spec para un backend.
+
+    Cada scope es un bloque (un for si many) que lee sus campos y actualiza los acumuladores
+    que los usan. Con explode cada nivel es un for anidado: los acumuladores de las rutas que
+    pasan por un nivel se reinician en cada instancia y la fila guarda una tupla con ellos
+    (sus demás hijos se recorren antes que el siguiente nivel para que la tupla esté completa).
+    Las columnas se arman al final, con el documento ya leído.
+    """
+
+    def __init__(self, spec, backend):
+        self.spec = spec
+        self.backend = backend
+        self.lines = []
+        self.constants = {}
+        self.xpaths = {}
+        self.counter = 0
+
+        self.scopes = {}
+        self._index_scopes(spec.root, ())
+        names = [name for name, _ in spec.explode]
+        self.levels = [tuple(names[:n]) for n in range(1, len(names) + 1)]
+        for level in self.levels:
+            if level not in self.scopes:
+                raise ValueError(f"explode: scope desconocido {'.'.join(level)}")
+
+        # Acumuladores sin repetir: variable y nivel de explode que los reinicia (0 = documento)
+        self.leaves, self.vars, self.depths, self.at = [], {}, {}, {}
+        for _, expr, _ in spec.columns:
+            for leaf in expr.leaves:
+                if id(leaf) in self.vars:
+                    continue
+                scope = self.scopes.get(leaf.scopes)
+                if scope is None or leaf.field not in dict(scope.fields):
+                    raise ValueError(f"Columna con ruta desconocida: {'.'.join(leaf.scopes + (leaf.field,))}")
+                self.vars[id(leaf)] = f"a{len(self.leaves)}"
+                self.depths[id(leaf)] = max(
+                    [n for n, level in enumerate(self.levels, 1) if leaf.scopes[:len(level)] == level] or [0])
+                self.at.setdefault(leaf.scopes, []).append(leaf)
+                self.leaves.append(leaf)
+        self.row_leaves = [leaf for leaf in self.leaves if self.depths[id(leaf)]]
+
+    def _index_scopes(self, scope, path):
+        self.scopes[path] = scope
+        for sub in scope.children:
+            self._index_scopes(sub, path + (sub.name,))
+
+    def emit(self, indent, line):
+        self.lines.append('    ' * indent + line)
+
+    def new(self, prefix):
+        self.counter += 1
+        return f"{prefix}{self.counter}"
+
+    def literal(self, value):
+        if value is None or isinstance(value, (str, int, tuple)) and repr(value).isprintable():
+            return repr(value)
+        name = f"k{len(self.constants)}"
+        self.constants[name] = value
+        return name
+
+    def xpath(self, text):
+        for name, known in self.xpaths.items():
+            if known == text:
+                return name
+        name = f"x{len(self.xpaths)}"
+        self.xpaths[name] = text
+        return name
+
+    def anchor(self, leaf):
+        depth = self.depths[id(leaf)]
+        return self.levels[depth - 1] if depth else ()
+
+    def unique(self, leaf):
+        """Una sola instancia posible por reinicio: todos los scopes bajo el ancla son many=False"""
+        anchor = self.anchor(leaf)
+        return all(not self.scopes[leaf.scopes[:n]].many for n in range(len(anchor) + 1, len(leaf.scopes) + 1))
+
+    def assigned(self, leaf):
+        """Ref de la propia instancia del nivel (o del comprobante): siempre tiene valor"""
+        return isinstance(leaf, Ref) and leaf.scopes == self.anchor(leaf)
+
+    def reads(self, scope):
+        return bool(scope.fields) or any(self.reads(sub) for sub in scope.children)
+
+    def source(self):
+        self.emit(0, 'def _extract(root):')
+        self.start(1, 0)
+        if self.levels:
+            self.emit(1, '_rows = []')
+        self.scope_body(self.spec.root, (), 'root', 1, 0)
+        self.finish(1)
+        return '\n'.join(self.lines) + '\n'
+
+    def compile(self):
+        source = self.source()
+        return compile(source, f"<spec {self.backend.name}>", 'exec'), self.constants, self.xpaths
+
+    def start(self, indent, depth):
+        """Valores iniciales de los acumuladores que se reinician en este nivel"""
+        for leaf in self.leaves:
+            if self.depths[id(leaf)] != depth:
+                continue
+            if self.assigned(leaf):
+                continue
+            self.emit(indent, f"{self.vars[id(leaf)]} = {leaf.initial}")
+
+    def scope_body(self, scope, path, elem, indent, depth):
+        values = {}
+        for name, field in scope.fields:
+            values[name] = self.new('f')
+            self.emit(indent, f"{values[name]} = {field.code(elem)}")
+        for leaf in self.at.get(path, ()):
+            if self.assigned(leaf):
+                # El campo ya es el valor de la columna en esta instancia: se usa su variable
+                self.vars[id(leaf)] = values[leaf.field]
+                continue
+            for line in leaf.update(self.vars[id(leaf)], values[leaf.field], elem, self.unique(leaf)):
+                self.emit(indent, line)
+
+        next_level = self.levels[depth] if depth < len(self.levels) and path == (self.levels[depth - 1] if depth else ()) else None
+        subs = sorted(scope.children, key=lambda sub: path + (sub.name,) == next_level)
+        for sub in subs:
+            sub_path = path + (sub.name,)
+            if sub_path == next_level:
+                self.level(sub, sub_path, elem, indent, depth + 1)
+            elif self.reads(sub):
+                node = self.select(sub, elem, indent)
+                self.scope_body(sub, sub_path, node, indent + 1, depth)
+
+    def select(self, sub, elem, indent):
+        """Abre el bloque del sub-scope (for o if) y devuelve la variable de su nodo"""
+        node = self.new('e')
+        where = ' and '.join(f"{node}.get({attr!r}, '') == {value!r}" for attr, value in sub.where)
+        alternatives = [self.backend.select_code(self, path, elem, first=not sub.many) for path in sub.paths]
+        if sub.many:
+            self.emit(indent, f"for {node} in {' or '.join(alternatives)}:")
+            if where:
+                self.emit(indent + 1, f"if not ({where}):")
+                self.emit(indent + 2, 'continue')
+        else:
+            self.emit(indent, f"{node} = {alternatives[0]}")
+            for alternative in alternatives[1:]:
+                self.emit(indent, f"if {node} is None:")
+                self.emit(indent + 1, f"{node} = {alternative}")
+            self.emit(indent, f"if {node} is not None{' and ' + where if where else ''}:")
+        return node
+
+    def level(self, sub, path, elem, indent, depth):
+        optional = self.spec.explode[depth - 1][1]
+        found = self.new('found')
+        if optional:
+            self.emit(indent, f"{found} = False")
+        node = self.select(sub, elem, indent)
+        if optional:
+            self.emit(indent + 1, f"{found} = True")
+        self.start(indent + 1, depth)
+        self.scope_body(sub, path, node, indent + 1, depth)
+        if depth == len(self.levels):
+            self.emit(indent + 1, f"_rows.append({self.row_tuple(None)})")
+        if optional:
+            # Nivel opcional sin instancias: una fila con sus acumuladores (y los más profundos) vacíos
+            self.emit(indent, f"if not {found}:")
+            self.emit(indent + 1, f"_rows.append({self.row_tuple(depth)})")
+
+    def row_tuple(self, empty_from):
+        items = [leaf.empty if empty_from is not None and self.depths[id(leaf)] >= empty_from else self.vars[id(leaf)]
+                 for leaf in self.row_leaves]
+        return f"({', '.join(items)},)" if items else '()'
+
+    def finish(self, indent):
+        row_vars = {id(leaf): f"t{n}" for n, leaf in enumerate(self.row_leaves)}
+
+        def var(leaf):
+            return row_vars.get(id(leaf)) or self.vars[id(leaf)]
+
+        items = []
+        for name, expr, decimals in self.spec.columns:
+            value = expr.result(var, self.literal)
+            if decimals is not None:
+                value = f"round({value}, {decimals})"
+            if self.levels and not any(id(leaf) in row_vars for leaf in expr.leaves):
+                # Columna del documento: se calcula una vez, no por fila
+                column = self.new('c')
+                self.emit(indent, f"{column} = {value}")
+                value = column
+            items.append(f"{name!r}: {value}")
+        row = '{' + ', '.join(items) + '}'
+        if not self.levels:
+            self.emit(indent, f"return {row}")
+        elif self.row_leaves:
+            self.emit(indent, f"return [{row} for ({', '.join(row_vars.values())},) in _rows]")
+        else:
+            self.emit(indent, f"return [{row} for _ in _rows]")
+
+
+class ExtractionSpec:
+    """Spec de extracción: scopes a leer + columnas (nombre, expresión, decimales).
+
+    explode='a.b.c?' genera una fila por cada instancia de la ruta; un nivel con '?'
+    produce una fila aunque no tenga instancias. Sin explode se devuelve una sola fila.
+    Se compila una vez por backend (_SpecCompiler); `source(backend)` muestra el código.
+    """
+
+    def __init__(self, root, columns, explode=None):
+        self.root = root
+        self.columns = [(name, expr, decimals) for name, expr, decimals in columns]
+        self.explode = [(level.rstrip('?'), level.endswith('?')) for level in explode.split('.')] if explode else []
+        self._local = threading.local()
+        # Se compila ya para etree: un spec con rutas inválidas falla al importar, no al parsear
+        self._compiled = {'etree': _SpecCompiler(self, EtreeBackend()).compile()}
+
+    def source(self, backend):
+        return _SpecCompiler(self, backend).source()
+
+    def reader(self, backend):
+        """Función de extracción para el backend; se guarda por hilo (los XPath de lxml no se comparten)"""
+        readers = getattr(self._local, 'readers', None)
+        if readers is None:
+            readers = self._local.readers = {}
+        read = readers.get(backend.name)
+        if read is None:
+            compiled = self._compiled.get(backend.name)
+            if compiled is None:
+                compiled = self._compiled[backend.name] = _SpecCompiler(self, backend).compile()
+            code, constants, xpaths = compiled
+            namespace = {'_MISSING': _MISSING, '_first': _first, '_follow': _follow, '_descendants': _descendants}
+            namespace.update(constants)
+            namespace.update(backend.compile_paths(xpaths))
+            exec(code, namespace)
+            read = readers[backend.name] = namespace['_extract']
+        return read
+
+    def extract(self, xml_text, backend=None):
+        backend = backend or XML
+        return self.reader(backend)(backend.fromstring(xml_text))
+
+
+def _impuestos_scopes(where=None):
+    """Traslados y Retenciones bajo un nodo Impuestos (de concepto o del comprobante)"""
+    return [
+        Scope('traslados', ['cfdi:Traslados/cfdi:Traslado', 'cfdi3:Traslados/cfdi3:Traslado', './/Traslado'],
+              fields={'importe': Num('Importe')}, where=where),
+        Scope('retenciones', ['cfdi:Retenciones/cfdi:Retencion', 'cfdi3:Retenciones/cfdi3:Retencion', './/Retencion'],
+              fields={'importe': Num('Importe')}, where=where),
+    ]
+
+# ============= PARSERS PARA FACTURAS (RECIBIDAS) =============
+
+INVOICE_SPEC = ExtractionSpec(
+    Scope('comprobante', fields={
+        'fecha': Attr('Fecha'),
+        'total': Num('Total'),
+        'subtotal': Num('SubTotal'),
+        'moneda': Attr('Moneda', 'MXN'),
+        'tipo': Attr('TipoDeComprobante'),
+    }, children=[
+        Scope('timbre', ['.//tfd:TimbreFiscalDigital'], fields={'uuid': Attr('UUID')}, many=False),
+        Scope('emisor', ['cfdi:Emisor', 'cfdi3:Emisor', 'Emisor'],
+              fields={'rfc': Attr('Rfc'), 'nombre': Attr('Nombre')}, many=False),
+        Scope('conceptos', ['cfdi:Conceptos/cfdi:Concepto', 'cfdi3:Conceptos/cfdi3:Concepto', './/Concepto'], fields={
+            'cantidad': Num('Cantidad'),
+            'importe': Num('Importe'),
+            'descripcion': Attr('Descripcion'),
+        }, children=[
+            Scope('impuestos', ['cfdi:Impuestos', 'cfdi3:Impuestos', 'Impuestos'],
+                  children=_impuestos_scopes(), many=False),
+        ]),
+    ]),
+    columns=[
+        ('UUID', Ref('timbre.uuid'), None),
+        ('Fecha', Ref('fecha'), None),
+        ('Tipo', Ref('tipo'), None),
+        ('RFC Emisor', Ref('emisor.rfc'), None),
+        ('Emisor', Ref('emisor.nombre'), None),
+        ('Descripcion', Join('conceptos.descripcion'), None),
+        ('Cantidad', Sum('conceptos.cantidad'), None),
+        ('Importe', Sum('conceptos.importe'), 2),
+        ('IVA', Sum('conceptos.impuestos.traslados.importe', where=('Impuesto', '002')), 2),
+        ('ISR Retenido', Sum('conceptos.impuestos.retenciones.importe', where=('Impuesto', '001')), 2),
+        ('IVA Retenido', Sum('conceptos.impuestos.retenciones.importe', where=('Impuesto', '002')), 2),
+        ('IEPS', Sum('conceptos.impuestos.traslados.importe', where=('Impuesto', '003')), 2),
+        ('Subtotal', Ref('subtotal'), None),
+        ('Total', Ref('total'), None),
+        ('Moneda', Ref('moneda'), None),
+    ],
+)
+
+
+def parse_xml_invoice_one_row(xml_text, backend=None):
+    """Parsea un XML de factura y devuelve UNA fila por factura"""
+    try:
+        return INVOICE_SPEC.extract(xml_text, backend)
+    except Exception:
+        return None
+
+# ============= PARSER PARA PAGOS =============
+
+PAYMENT_SPEC = ExtractionSpec(
+    Scope('comprobante', fields={
+        'fecha': Attr('Fecha'),
+        'folio': Attr('Folio'),
+    }, children=[
+        Scope('receptor', ['cfdi:Receptor', 'Receptor'],
+              fields={'rfc': Attr('Rfc'), 'nombre': Attr('Nombre')}, many=False),
+        # Complemento de pagos: cada Pago con sus documentos relacionados
+        Scope('pagos', ['.//pago20:Pagos', './/Pagos'], many=False, children=[
+            Scope('pago', ['pago20:Pago', './/Pago'], fields={'monto': Num('Monto')}, children=[
+                Scope('doctos', ['pago20:DoctoRelacionado', './/DoctoRelacionado'], fields={
+                    'folio': Attr('Folio'),
+                    # CORREGIDO: leer ImpPagado correctamente
+                    'monto': Num('ImpPagado', 'ImPagado', 'MontoPagado', 'MontoPagedo'),
+                }),
+            ]),
+        ]),
+    ]),
+    columns=[
+        ('Receptor', Ref('receptor.nombre'), None),
+        ('Fecha', Ref('fecha'), None),
+        ('Mes', Const(''), None),  # Se llena después
+        ('RFC Receptor', Ref('receptor.rfc'), None),
+        ('Folio Pago', Ref('folio'), None),
+        ('Folio Documento', Ref('pagos.pago.doctos.folio'), None),
+        # Si el pago no tiene documentos relacionados se usa el monto del pago
+        ('Monto Pagado', Coalesce('pagos.pago.doctos.monto', 'pagos.pago.monto'), 2),
+    ],
+    explode='pagos.pago.doctos?',
+)
+
+
+def parse_xml_payment(xml_text, backend=None):
+    """Parsea un XML de pago (Comprobante de Pago con complemento pago20)"""
+    try:
+        return PAYMENT_SPEC.extract(xml_text, backend)
+    except Exception:
+        return []
+
+# ============= PARSER PARA FACTURAS EMITIDAS =============
+
+
+def _fecha_dd_mm_aa(fecha):
+    fecha_dt = parse_sat_datetime(fecha)
+    if fecha_dt is None:
+        return fecha
+    return f"{fecha_dt.day:02d}/{fecha_dt.month:02d}/{fecha_dt.year % 100:02d}"
+
+
+EMITTED_INVOICE_SPEC = ExtractionSpec(
+    Scope('comprobante', fields={
+        'fecha': Attr('Fecha'),
+        'subtotal': Num('SubTotal'),
+        'total': Num('Total'),
+        'descuento': Num('Descuento'),
+        'folio': Attr('Folio'),
+        'serie': Attr('Serie'),
+    }, children=[
+        Scope('receptor', ['cfdi:Receptor', 'cfdi3:Receptor', 'Receptor'],
+              fields={'rfc': Attr('Rfc'), 'nombre': Attr('Nombre')}, many=False),
+        # Impuestos a nivel comprobante (solo IVA)
+        Scope('impuestos', ['cfdi:Impuestos', 'cfdi3:Impuestos', 'Impuestos'],
+              children=_impuestos_scopes(where={'Impuesto': '002'}), many=False),
+    ]),
+    columns=[
+        ('FECHA DD/MM/AA', Computed(_fecha_dd_mm_aa, 'fecha'), None),
+        ('CLIENTE', Ref('receptor.nombre'), None),
+        ('RFC', Ref('receptor.rfc'), None),
+        ('No FACTURA', Computed(lambda serie, folio: f"{serie}{folio}" if serie else folio, 'serie', 'folio'), None),
+        # Estatus básico (luego puedes enriquecerlo)
+        ('ESTATUS', Const('Emitida'), None),
+        ('Subtotal', Ref('subtotal'), 2),
+        ('OTRO (DESCUENTO)', Ref('descuento'), 2),
+        ('IVA', Sum('impuestos.traslados.importe'), 2),
+        ('RET IVA', Sum('impuestos.retenciones.importe'), 2),
+        ('TOTAL', Ref('total'), 2),
+    ],
+)
+
+
+def parse_xml_emitted_invoice(xml_text, backend=None):
+    """Parsea un XML de factura emitida y devuelve UNA fila con la estructura deseada"""
+    try:
+        return EMITTED_INVOICE_SPEC.extract(xml_text, backend)
+    except Exception:
+        return None
+
+# ============= COMPARACIÓN DE BACKENDS =============
+
+XML_PARSERS = {
+    'facturas': parse_xml_invoice_one_row,
+    'pagos': parse_xml_payment,
+    'emitidas': parse_xml_emitted_invoice,
+}
+
+
+def benchmark_xml_backends(xml_texts, repeat=3):
+    """Compara los backends disponibles con los tres parsers sobre los mismos XML.
+
+    Devuelve ({backend: archivos por segundo}, diferencias) donde diferencias es la lista
+    de (parser, índice) cuya salida no coincide con la del backend estándar.
+    """
+    backends = [EtreeBackend()]
+    if LET is not None:
+        backends.append(LxmlBackend())
+
+    throughput = {}
+    reference = None
+    mismatches = []
+
+    for backend in backends:
+        outputs = {key: [parse(t, backend) for t in xml_texts] for key, parse in XML_PARSERS.items()}
+        if reference is None:
+            reference = outputs
+        else:
+            for key, rows in outputs.items():
+                for idx, (expected, got) in enumerate(zip(reference[key], rows)):
+                    if expected != got:
+                        mismatches.append((key, idx))
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for parse in XML_PARSERS.values():
+                for xml_text in xml_texts:
+                    parse(xml_text, backend)
+        elapsed = time.perf_counter() - start
+        throughput[backend.name] = repeat * len(XML_PARSERS) * len(xml_texts) / elapsed if elapsed else 0.0
+
+    return throughput, mismatches
+
+# ============= LECTURA DE ARCHIVOS (CARGA Y CARPETAS DEL SERVIDOR) =============
+
+# Carpeta raíz permitida para el modo de ruta local; si no está definida el modo se oculta
+LOCAL_ROOT = os.environ.get('SAT_XML_LOCAL_ROOT', '')
+# Archivos que el hilo lector puede tener leídos por adelantado
+PREFETCH_DEPTH = 64
+
+
+class LocalXMLFile:
+    """Archivo XML del servidor con la misma interfaz que usan los procesadores (name, size, read)"""
+
+    def __init__(self, path, size, mtime=0, name=None):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        if name is None:
+            name = os.path.relpath(path, LOCAL_ROOT) if LOCAL_ROOT else os.path.basename(path)
+        self.name = name
+
+    def read(self):
+        with open(self.path, 'rb') as fh:
+            return fh.read()
+
+
+def scan_xml_directory(root_dir):
+    """Recorre una carpeta (y subcarpetas) con os.scandir y devuelve sus XML ordenados por ruta.
+
+    No sigue enlaces simbólicos (ni a carpetas ni a archivos) para no salir de la carpeta raíz.
+    """
+    found = []
+    pending = [root_dir]
+
+    while pending:
+        current = pending.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False) and entry.name.lower().endswith('.xml'):
+                        stat = entry.stat()
+                        found.append(LocalXMLFile(entry.path, stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            # Carpetas sin permisos o eliminadas durante el recorrido
+            continue
+
+    found.sort(key=lambda f: f.path)
+    return found
+
+
+def read_file_bytes(f):
+    """Contenido completo del archivo; los subidos se leen sin mover su posición para poder leerlos otra vez"""
+    if hasattr(f, 'getvalue'):
+        return f.getvalue()
+    return f.read()
+
+
+def iter_file_contents(files, depth=PREFETCH_DEPTH):
+    """Lee los archivos en un hilo de fondo y entrega (archivo, bytes) en el mismo orden.
+
+    La lectura de disco se traslapa con el parseo. Si leer un archivo falla se entrega
+    la excepción en lugar de los bytes para que el procesador la registre como error.
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def reader():
+        for f in files:
+            try:
+                data = read_file_bytes(f)
+            except Exception as e:
+                data = e
+            if not put((f, data)):
+                return
+        put((None, end))
+
+    thread = threading.Thread(target=reader, name='xml-prefetch', daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            f, data = buffer.get()
+            if data is end:
+                return
+            yield f, data
+    finally:
+        stop.set()
+
+
+class LocalXMLListing(list):
+    """Listado de una carpeta del servidor; es de solo lectura y guarda su huella (files_fingerprint)"""
+    fingerprint = None
+
+
+# cache_resource entrega la misma lista en cada rerun sin copiarla (cache_data la serializaría cada vez)
+@st.cache_resource(ttl=60, show_spinner="Buscando archivos XML...")
+def _scan_local_directory(target):
+    return LocalXMLListing(scan_xml_directory(target))
+
+
+def local_directory_input(key):
+    """Campo opcional para procesar una carpeta del servidor en lugar de subir archivos.
+
+    Solo aparece si SAT_XML_LOCAL_ROOT está definido y solo acepta rutas dentro de esa carpeta.
+    """
+    if not LOCAL_ROOT:
+        return []
+
+    ruta = st.text_input(
+        "O procesar una carpeta del servidor",
+        key=f"{key}_local_dir",
+        help=f"Ruta relativa a {LOCAL_ROOT}"
+    )
+    if not ruta:
+        return []
+
+    root = os.path.realpath(LOCAL_ROOT)
+    target = os.path.realpath(os.path.join(root, ruta))
+    if os.path.commonpath([root, target]) != root or not os.path.isdir(target):
+        st.markdown('<div class="status-error">La carpeta no existe o está fuera de la ruta permitida</div>', unsafe_allow_html=True)
+        return []
+
+    return _scan_local_directory(target)
+
+# ============= PIPELINE: LECTURA -> PARSEO -> AGREGACIÓN =============
+
+# Hilos de parseo compartidos por todas las sesiones
+PARSE_WORKERS = int(os.environ.get('SAT_XML_PARSE_WORKERS', os.cpu_count() or 4))
+# Con etree (o un solo hilo) el pool no paraleliza nada y solo agrega futures y cambios de
+# contexto: se parsea en el hilo que agrega, con la lectura anticipada en segundo plano
+PARSE_IN_THREADS = XML.releases_gil and PARSE_WORKERS > 1
+# Archivos en vuelo por trabajo entre la lectura y la agregación
+PARSE_WINDOW = PARSE_WORKERS * 8
+# Intervalo mínimo entre actualizaciones de la barra de progreso (segundos)
+PROGRESS_INTERVAL = 0.25
+
+
+def new_parse_pool():
+    """Pool de hilos de parseo, o None si con el backend actual no conviene (PARSE_IN_THREADS)"""
+    if not PARSE_IN_THREADS:
+        return None
+    return ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix='xml-parse')
+
+
+@st.cache_resource
+def get_parse_pool():
+    """Pool de parseo único para todo el proceso"""
+    return new_parse_pool()
+
+
+def _parse_raw(parse_fn, raw):
+    # Los bytes van directo al parser, sin decodificarlos a str (ni volver a codificarlos para lxml)
+    try:
+        if isinstance(raw, Exception):
+            raise raw
+        return parse_fn(raw)
+    except Exception as e:
+        return e
+
+
+def iter_parsed_files(files, parse_fn, pool=None):
+    """Procesa los archivos por etapas y entrega (archivo, resultado) en el orden original.
+
+    El hilo lector (iter_file_contents) alimenta al pool de parseo y quien itera agrega
+    los resultados; como máximo PARSE_WINDOW archivos están en vuelo a la vez. Sin pool
+    (ver PARSE_IN_THREADS) se parsea en el hilo que itera. Si leer o parsear un archivo
+    falla, el resultado es la excepción.
+    """
+    pool = pool or get_parse_pool()
+    if pool is None:
+        for f, raw in iter_file_contents(files):
+            yield f, _parse_raw(parse_fn, raw)
+        return
+
+    pending = deque()
+
+    try:
+        for f, raw in iter_file_contents(files):
+            pending.append((f, pool.submit(_parse_raw, parse_fn, raw)))
+            if len(pending) >= PARSE_WINDOW:
+                done_file, future = pending.popleft()
+                yield done_file, future.result()
+
+        while pending:
+            done_file, future = pending.popleft()
+            yield done_file, future.result()
+    finally:
+        # Si la sesión se detiene a medio trabajo, no dejar parseos pendientes en el pool
+        for _, future in pending:
+            future.cancel()
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds} s"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes} min {seconds:02d} s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours} h {minutes:02d} min"
+
+
+def eta_text(start, done, total):
+    """Tiempo restante según el ritmo observado desde start; vacío mientras no hay suficiente información"""
+    elapsed = time.monotonic() - start
+    if done <= 0 or done >= total or elapsed < 1:
+        return ''
+    return f" · quedan ~{format_duration(elapsed / done * (total - done))}"
+
+
+class BatchedProgress:
+    """Barra y texto de progreso que se actualizan como máximo cada PROGRESS_INTERVAL segundos.
+
+    Cada llamada a progress()/text() envía un mensaje por websocket; con miles de archivos
+    actualizar por archivo frena el procesamiento por sí solo.
+    """
+
+    def __init__(self, total, interval=PROGRESS_INTERVAL):
+        self.total = max(total, 1)
+        self.interval = interval
+        self._last = 0.0
+        self._start = time.monotonic()
+        self.progress_bar = st.progress(0)
+        self.status_text = st.empty()
+
+    def update(self, done, message):
+        now = time.monotonic()
+        if done < self.total and now - self._last < self.interval:
+            return
+        self._last = now
+        self.progress_bar.progress(min(done / self.total, 1.0))
+        self.status_text.text(message + eta_text(self._start, done, self.total))
+
+    def close(self):
+        self.progress_bar.empty()
+        self.status_text.empty()
+
+# ============= PROCESADORES DE ARCHIVOS =============
+
+def process_invoice_files(uploaded_files, progress=None, pool=None):
+    """Procesa múltiples archivos XML de facturas"""
+    all_invoices = []
+    sources = []
+    errors = []
+
+    progress = progress or BatchedProgress(len(uploaded_files))
+
+    for idx, (uploaded_file, invoice) in enumerate(iter_parsed_files(uploaded_files, parse_xml_invoice_one_row, pool)):
+        if isinstance(invoice, Exception):
+            errors.append(f"{uploaded_file.name}: {str(invoice)}")
+        elif invoice:
+            all_invoices.append(invoice)
+            sources.append(uploaded_file.name)
+        else:
+            errors.append(f"{uploaded_file.name}: No se pudo extraer información")
+
+        progress.update(idx + 1, f"Procesado: {uploaded_file.name}")
+
+    progress.close()
+    return build_invoice_frame(all_invoices, sources, errors), errors
+
+
+def build_invoice_frame(all_invoices, sources, errors):
+    """Agregación de las facturas ya parseadas: DataFrame ordenado por fecha (None si no hay filas).
+
+    Las fechas inválidas se agregan a errors con el nombre de su archivo (sources).
+    """
+    if not all_invoices:
+        return None
+
+    df = pd.DataFrame(all_invoices)
+    fechas, invalidas = parse_sat_dates(df['Fecha'].tolist())
+    for i in invalidas:
+        errors.append(f"{sources[i]}: Fecha inválida '{all_invoices[i]['Fecha']}'")
+    df['Fecha'] = fechas
+    df = df.sort_values('Fecha').reset_index(drop=True)
+    df['Fecha'] = format_sat_dates(df['Fecha'].to_numpy())
+
+    # Reordenar columnas según el orden deseado
+    columnas_ordenadas = ['UUID', 'Tipo', 'Fecha', 'Emisor', 'RFC Emisor', 'Descripcion', 
+                          'Subtotal', 'IVA', 'IVA Retenido', 'ISR Retenido', 'IEPS', 'Total']
+    return df[columnas_ordenadas]
+
+def process_payment_files(uploaded_files, progress=None, pool=None):
+    """Procesa múltiples archivos XML de pagos"""
+    all_payments = []
+    sources = []
+    errors = []
+
+    progress = progress or BatchedProgress(len(uploaded_files))
+
+    for idx, (uploaded_file, payments) in enumerate(iter_parsed_files(uploaded_files, parse_xml_payment, pool)):
+        if isinstance(payments, Exception):
+            errors.append(f"{uploaded_file.name}: {str(payments)}")
+        elif payments:
+            all_payments.extend(payments)
+            sources.extend([uploaded_file.name] * len(payments))
+        else:
+            errors.append(f"{uploaded_file.name}: No se encontraron pagos")
+
+        progress.update(idx + 1, f"Procesado: {uploaded_file.name} ({len(all_payments)} pago(s) en total)")
+
+    progress.close()
+    return build_payment_frame(all_payments, sources, errors), errors
+
+
+def build_payment_frame(all_payments, sources, errors):
+    """Agregación de los pagos ya parseados (una fila por documento): DataFrame ordenado por fecha con su mes"""
+    if not all_payments:
+        return None
+
+    df = pd.DataFrame(all_payments)
+    fechas, invalidas = parse_sat_dates(df['Fecha'].tolist())
+    # Un archivo con varios pagos se reporta una sola vez
+    for name, fecha in dict.fromkeys((sources[i], all_payments[i]['Fecha']) for i in invalidas):
+        errors.append(f"{name}: Fecha inválida '{fecha}'")
+    df['Fecha'] = fechas
+    df = df.sort_values('Fecha').reset_index(drop=True)
+
+    # Agregar mes según la fecha
+    meses = {
+        1: 'Enero', 2: 'Febrero', 3: 'Marzo', 4: 'Abril',
+        5: 'Mayo', 6: 'Junio', 7: 'Julio', 8: 'Agosto',
+        9: 'Septiembre', 10: 'Octubre', 11: 'Noviembre', 12: 'Diciembre'
+    }
+    df['Mes'] = df['Fecha'].dt.month.map(meses)
+
+    # Convertir fecha a string
+    df['Fecha'] = format_sat_dates(df['Fecha'].to_numpy())
+
+    # Reordenar columnas: Receptor, Fecha, Mes, RFC Receptor, ...
+    columnas_ordenadas = ['Receptor', 'Fecha', 'Mes', 'RFC Receptor', 'Folio Pago', 'Folio Documento', 'Monto Pagado']
+    return df[columnas_ordenadas]
+
+def process_emitted_invoice_files(uploaded_files, progress=None, pool=None):
+    """Procesa múltiples archivos XML de facturas emitidas"""
+    all_rows = []
+    sources = []
+    errors = []
+
+    progress = progress or BatchedProgress(len(uploaded_files))
+
+    for idx, (uploaded_file, row) in enumerate(iter_parsed_files(uploaded_files, parse_xml_emitted_invoice, pool)):
+        if isinstance(row, Exception):
+            errors.append(f"{uploaded_file.name}: {str(row)}")
+        elif row:
+            all_rows.append(row)
+            sources.append(uploaded_file.name)
+        else:
+            errors.append(f"{uploaded_file.name}: No se pudo extraer información")
+
+        progress.update(idx + 1, f"Procesado: {uploaded_file.name}")
+
+    progress.close()
+    return build_emitted_invoice_frame(all_rows, sources, errors), errors
+
+
+def build_emitted_invoice_frame(all_rows, sources, errors):
+    """Agregación de las facturas emitidas ya parseadas: DataFrame ordenado por fecha (None si no hay filas)"""
+    if not all_rows:
+        return None
+
+    df = pd.DataFrame(all_rows)
+    # Ordenar por fecha; el parser ya la dejó como dd/mm/aa, las que no se pudieron leer se reportan
+    fecha_sort = parse_emitted_dates(df['FECHA DD/MM/AA'].tolist())
+    for i in np.flatnonzero(np.isnat(fecha_sort)):
+        errors.append(f"{sources[i]}: Fecha inválida '{all_rows[i]['FECHA DD/MM/AA']}'")
+    df = df.assign(_fecha_sort=fecha_sort).sort_values('_fecha_sort').drop(columns=['_fecha_sort'])
+    return df.reset_index(drop=True)
+
+# ============= COLA COMPARTIDA Y LÍMITES POR SESIÓN =============
+
+# Trabajos que se procesan a la vez en todo el servidor; el resto espera turno
+MAX_ACTIVE_JOBS = int(os.environ.get('SAT_XML_WORKERS', max(2, (os.cpu_count() or 2) // 2)))
+# Límites de cada sesión por trabajo; archivos y MB cuentan solo lo subido por el navegador,
+# las carpetas del servidor (SAT_XML_LOCAL_ROOT) se leen de disco y solo las limita la memoria
+MAX_FILES_PER_SESSION = int(os.environ.get('SAT_XML_MAX_FILES', 50000))
+MAX_MB_PER_SESSION = int(os.environ.get('SAT_XML_MAX_MB', 1024))
+MAX_MEMORY_MB_PER_SESSION = int(os.environ.get('SAT_XML_MEMORY_MB', 2048))
+# Estimación de memoria: árbol XML en memoria ≈ 10x el archivo y ~1 KB por fila del resultado
+XML_TREE_FACTOR = 10
+ROW_BYTES = 1024
+
+
+class WorkScheduler:
+    """Cola compartida por todas las sesiones del proceso.
+
+    Como máximo `slots` trabajos se ejecutan a la vez. Los turnos libres se reparten por
+    ronda entre sesiones, de modo que una sesión con varios trabajos en espera no deja
+    sin turno a las demás.
+    """
+
+    def __init__(self, slots):
+        self.slots = slots
+        self._cond = threading.Condition()
+        self._waiting = OrderedDict()  # session_id -> deque de tickets
+        self._granted = set()
+
+    def _grant(self):
+        while len(self._granted) < self.slots and self._waiting:
+            session_id, tickets = next(iter(self._waiting.items()))
+            self._granted.add(tickets.popleft())
+            if tickets:
+                self._waiting.move_to_end(session_id)
+            else:
+                del self._waiting[session_id]
+        self._cond.notify_all()
+
+    def _position(self, ticket):
+        """Trabajos que recibirán turno antes que `ticket` siguiendo el orden por ronda"""
+        queues = [list(tickets) for tickets in self._waiting.values()]
+        position = 0
+        for depth in range(max(len(q) for q in queues)):
+            for q in queues:
+                if depth < len(q):
+                    if q[depth] is ticket:
+                        return position
+                    position += 1
+        return position
+
+    @contextmanager
+    def acquire(self, session_id, on_wait=None):
+        """Espera turno para `session_id`; `on_wait(posición)` se llama mientras espera"""
+        ticket = object()
+        with self._cond:
+            self._waiting.setdefault(session_id, deque()).append(ticket)
+            self._grant()
+
+        try:
+            while True:
+                with self._cond:
+                    if self._cond.wait_for(lambda: ticket in self._granted, timeout=0.5):
+                        break
+                    position = self._position(ticket)
+                if on_wait is not None:
+                    on_wait(position)
+            yield
+        finally:
+            with self._cond:
+                if ticket in self._granted:
+                    self._granted.discard(ticket)
+                else:
+                    # La sesión se detuvo (rerun o desconexión) mientras esperaba
+                    tickets = self._waiting.get(session_id)
+                    if tickets is not None and ticket in tickets:
+                        tickets.remove(ticket)
+                        if not tickets:
+                            del self._waiting[session_id]
+                self._grant()
+
+
+@st.cache_resource
+def get_work_scheduler():
+    """Una sola cola para todo el proceso, compartida por todas las sesiones"""
+    return WorkScheduler(MAX_ACTIVE_JOBS)
+
+
+def get_session_id():
+    if '_session_id' not in st.session_state:
+        st.session_state['_session_id'] = uuid.uuid4().hex
+    return st.session_state['_session_id']
+
+
+def estimate_session_memory(files):
+    """Memoria aproximada de un trabajo: archivos subidos en RAM + árbol del archivo más grande + filas"""
+    sizes = [getattr(f, 'size', 0) or 0 for f in files]
+    if not sizes:
+        return 0
+    # Los archivos locales se leen de disco, solo los subidos permanecen en memoria
+    resident = sum(size for f, size in zip(files, sizes) if not isinstance(f, LocalXMLFile))
+    return resident + max(sizes) * XML_TREE_FACTOR + len(files) * ROW_BYTES
+
+
+def check_session_limits(files):
+    """Devuelve un mensaje de error si el trabajo excede los límites por sesión, o None"""
+    uploaded = [f for f in files if not isinstance(f, LocalXMLFile)]
+    total_mb = sum(getattr(f, 'size', 0) or 0 for f in uploaded) / (1024 * 1024)
+    memory_mb = estimate_session_memory(files) / (1024 * 1024)
+
+    if len(uploaded) > MAX_FILES_PER_SESSION:
+        return f"Se seleccionaron {len(uploaded)} archivos; el máximo por sesión es {MAX_FILES_PER_SESSION}"
+    if total_mb > MAX_MB_PER_SESSION:
+        return f"Los archivos suman {total_mb:.0f} MB; el máximo por sesión es {MAX_MB_PER_SESSION} MB"
+    if memory_mb > MAX_MEMORY_MB_PER_SESSION:
+        return f"El procesamiento requeriría ~{memory_mb:.0f} MB de memoria; el máximo por sesión es {MAX_MEMORY_MB_PER_SESSION} MB"
+    return None
+
+
+def run_in_shared_queue(process_fn, files):
+    """Ejecuta un procesador respetando los límites de la sesión y el turno en la cola compartida"""
+    limit_error = check_session_limits(files)
+    if limit_error:
+        return None, [limit_error]
+
+    queue_text = st.empty()
+
+    def on_wait(position):
+        queue_text.markdown(
+            f'<div class="status-info">En cola: {position} trabajo(s) antes que el tuyo</div>',
+            unsafe_allow_html=True
+        )
+
+    try:
+        with get_work_scheduler().acquire(get_session_id(), on_wait):
+            queue_text.empty()
+            return process_fn(files)
+    finally:
+        queue_text.empty()
+
+# ============= RESULTADOS POR SESIÓN =============
+
+# Memoria máxima por sesión para DataFrames y exportaciones ya generados
+RESULTS_MB_PER_SESSION = int(os.environ.get('SAT_XML_RESULTS_MB', 256))
+
+
+class ResultCache:
+    """Resultados ya procesados de una sesión (DataFrame, errores y exportaciones).
+
+    Sobreviven a los reruns de Streamlit (p. ej. al pulsar descargar). Cuando el tamaño
+    total supera `max_bytes` se desalojan primero los menos usados recientemente.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, df, errors):
+        self.discard(key)
+        size = int(df.memory_usage(deep=True).sum()) if df is not None else 0
+        entry = {'df': df, 'errors': errors, 'exports': {}, 'size': size}
+        self._entries[key] = entry
+        self.total_bytes += size
+        self._evict(keep=key)
+        return entry
+
+    def add_export(self, key, fmt, data):
+        entry = self.get(key)
+        if entry is None:
+            return data
+        entry['exports'][fmt] = data
+        entry['size'] += len(data)
+        self.total_bytes += len(data)
+        self._evict(keep=key)
+        return data
+
+    def discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry['size']
+
+    def _evict(self, keep):
+        # El resultado recién usado se conserva aunque por sí solo exceda el límite
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            oldest = next(iter(self._entries))
+            if oldest == keep:
+                break
+            self.discard(oldest)
+
+
+def get_result_cache():
+    if '_result_cache' not in st.session_state:
+        st.session_state['_result_cache'] = ResultCache(RESULTS_MB_PER_SESSION * 1024 * 1024)
+    return st.session_state['_result_cache']
+
+
+def files_fingerprint(files):
+    """Identifica un conjunto de archivos sin leer su contenido (id de carga o ruta, tamaño y fecha)"""
+    if getattr(files, 'fingerprint', None) is not None:
+        return files.fingerprint
+    digest = hashlib.sha1()
+    for f in files:
+        file_id = getattr(f, 'file_id', None) or getattr(f, 'path', None) or f.name
+        digest.update(f"{file_id}\0{getattr(f, 'size', '')}\0{getattr(f, 'mtime', '')}\n".encode('utf-8'))
+    fingerprint = digest.hexdigest()
+    if isinstance(files, LocalXMLListing):
+        files.fingerprint = fingerprint
+    return fingerprint
+
+
+def result_key(kind, files):
+    return (kind, files_fingerprint(files))
+
+
+def get_results(key, process_fn, files):
+    """Devuelve (df, errores) del conjunto de archivos, procesándolo solo la primera vez.
+
+    Se llama únicamente tras un clic o con el resultado en caché (ver active_views).
+    """
+    cache = get_result_cache()
+    entry = cache.get(key)
+    if entry is None:
+        df, errors = run_in_shared_queue(process_fn, files)
+        entry = cache.put(key, df, errors)
+    return entry['df'], entry['errors']
+
+
+def get_cached_export(key, fmt):
+    entry = get_result_cache().get(key)
+    return entry['exports'].get(fmt) if entry is not None else None
+
+
+def store_export(key, fmt, data):
+    return get_result_cache().add_export(key, fmt, data)
+
+
+def active_views(key, result, process_clicked, preview_clicked, estimate_clicked=False):
+    """Vistas abiertas ('download', 'preview', 'estimate') para el conjunto de archivos actual.
+
+    Se recuerdan entre reruns y se olvidan cuando cambian los archivos seleccionados. Solo
+    un clic procesa: si el resultado ya salió de la caché (SAT_XML_RESULTS_MB), las vistas
+    recordadas se cierran en lugar de reprocesar en cada rerun.
+    """
+    state_key = f'_views_{key}'
+    state = st.session_state.get(state_key)
+    if state is None or state['result'] != result:
+        state = {'result': result, 'views': set()}
+    result_views = {'download', 'preview'}
+    if (state['views'] & result_views and not (process_clicked or preview_clicked)
+            and get_result_cache().get(result) is None):
+        state['views'] -= result_views
+        st.markdown(
+            '<div class="status-info">Los resultados se liberaron de memoria; pulsa Procesar o Vista Previa para generarlos de nuevo</div>',
+            unsafe_allow_html=True
+        )
+    if process_clicked:
+        state['views'].add('download')
+    if preview_clicked:
+        state['views'].add('preview')
+    if estimate_clicked:
+        state['views'].add('estimate')
+    st.session_state[state_key] = state
+    return state['views']
+
+# ============= EXPORTACIÓN A EXCEL =============
+
+# Filas por hoja de Excel, incluido el encabezado
+EXCEL_MAX_ROWS = 1_048_576
+
+# Tipos de columna: el formato se aplica al escribir cada celda, no después sobre la hoja
+TEXT, DATE, NUMBER, CURRENCY = 'text', 'date', 'number', 'currency'
+EXCEL_NUMBER_FORMATS = {
+    NUMBER: '#,##0.00',
+    CURRENCY: '"$"#,##0.00',
+}
+
+# Por tipo de resultado: hoja, (formato de la fecha en el DataFrame, formato en Excel) y columnas (ancho, tipo)
+EXCEL_SHEETS = {
+    'invoices': {
+        'sheet': 'Facturas',
+        'date_format': ('%Y-%m-%d %H:%M:%S', 'yyyy-mm-dd hh:mm:ss'),
+        'columns': {
+            'UUID': (40, TEXT), 'Fecha': (20, DATE), 'Tipo': (8, TEXT), 'RFC Emisor': (15, TEXT),
+            'Emisor': (35, TEXT), 'Descripcion': (60, TEXT), 'Cantidad': (12, NUMBER),
+            'Importe': (12, CURRENCY), 'IVA': (12, CURRENCY), 'ISR Retenido': (15, CURRENCY),
+            'IVA Retenido': (15, CURRENCY), 'IEPS': (12, CURRENCY), 'Subtotal': (12, CURRENCY),
+            'Total': (12, CURRENCY), 'Moneda': (10, TEXT),
+        },
+    },
+    'payments': {
+        'sheet': 'Pagos',
+        'date_format': ('%Y-%m-%d %H:%M:%S', 'yyyy-mm-dd hh:mm:ss'),
+        'columns': {
+            'Receptor': (35, TEXT), 'Fecha': (20, DATE), 'Mes': (12, TEXT), 'RFC Receptor': (15, TEXT),
+            'Folio Pago': (15, TEXT), 'Folio Documento': (15, TEXT), 'Monto Pagado': (15, CURRENCY),
+        },
+    },
+    'emitted_invoices': {
+        'sheet': 'Facturas emitidas',
+        'date_format': ('%d/%m/%y', 'dd/mm/yy'),
+        'columns': {
+            'FECHA DD/MM/AA': (18, DATE), 'CLIENTE': (35, TEXT), 'RFC': (15, TEXT),
+            'No FACTURA': (15, TEXT), 'ESTATUS': (12, TEXT), 'Subtotal': (14, CURRENCY),
+            'OTRO (DESCUENTO)': (18, CURRENCY), 'IVA': (12, CURRENCY), 'RET IVA': (12, CURRENCY),
+            'TOTAL': (14, CURRENCY),
+        },
+    },
+}
+
+
+_DDMMYY_RE = re.compile(r'[0-9]{2}/[0-9]{2}/[0-9]{2}')
+
+
+def _parse_ddmmyy(value):
+    """Equivalente a strptime(value, '%d/%m/%y') para el formato fijo de facturas emitidas"""
+    if _DDMMYY_RE.fullmatch(value) is None:
+        raise ValueError(value)
+    year = int(value[6:])
+    return datetime(year + (1900 if year >= 69 else 2000), int(value[3:5]), int(value[:2]))
+
+
+# Lectura de cada formato de fecha que dejan los procesadores, sin pasar por strptime
+EXCEL_DATE_PARSERS = {
+    '%Y-%m-%d %H:%M:%S': datetime.fromisoformat,
+    '%d/%m/%y': _parse_ddmmyy,
+}
+
+
+def _missing(value):
+    return value is None or (isinstance(value, float) and value != value)
+
+
+def _excel_cell_converter(col_type, date_format):
+    """Conversión de un valor de la columna al tipo de celda; se aplica fila por fila al escribir"""
+    if col_type in EXCEL_NUMBER_FORMATS:
+        def convert(value):
+            if _missing(value):
+                return None
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return None
+        return convert
+
+    if col_type == DATE:
+        parse = EXCEL_DATE_PARSERS.get(date_format) or (lambda value: datetime.strptime(value, date_format))
+
+        def convert(value):
+            if _missing(value):
+                return None
+            try:
+                return parse(value)
+            except (TypeError, ValueError):
+                # Solo en facturas emitidas: la fecha que no se pudo leer conserva su texto original
+                # (en facturas y pagos ya llega como None)
+                return value
+        return convert
+
+    return lambda value: None if _missing(value) else value
+
+
+def write_excel(df, kind, target):
+    """Escribe el resultado en un libro xlsx en una sola pasada (target: ruta o búfer).
+
+    Usa un libro write_only: las filas se escriben en streaming con su formato numérico o de
+    fecha ya asignado, y anchos, encabezado fijo y autofiltro se definen antes de la primera fila.
+    """
+    layout = EXCEL_SHEETS[kind]
+    date_format, excel_date_format = layout['date_format']
+    col_types = [layout['columns'].get(col, (20, TEXT)) for col in df.columns]
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(layout['sheet'])
+    for idx, (width, _) in enumerate(col_types, start=1):
+        ws.column_dimensions[get_column_letter(idx)].width = width
+    ws.freeze_panes = 'A2'
+    last_col = get_column_letter(max(len(df.columns), 1))
+    ws.auto_filter.ref = f"A1:{last_col}{len(df) + 1}"
+
+    header_font = Font(bold=True)
+    header = []
+    for col in df.columns:
+        cell = WriteOnlyCell(ws, value=col)
+        cell.font = header_font
+        header.append(cell)
+    ws.append(header)
+
+    formats = [
+        excel_date_format if col_type == DATE else EXCEL_NUMBER_FORMATS.get(col_type)
+        for _, col_type in col_types
+    ]
+    # Cada columna se recorre en paralelo y se convierte al escribir su fila, sin copiar la hoja
+    columns = [
+        map(_excel_cell_converter(col_type, date_format), df[col])
+        for col, (_, col_type) in zip(df.columns, col_types)
+    ]
+    typed = [idx for idx, fmt in enumerate(formats) if fmt]
+
+    for values in zip(*columns):
+        row = list(values)
+        for idx in typed:
+            value = row[idx]
+            # Una fecha emitida no leída queda como texto, sin formato de fecha
+            if value is not None and not isinstance(value, str):
+                cell = WriteOnlyCell(ws, value=value)
+                cell.number_format = formats[idx]
+                row[idx] = cell
+        ws.append(row)
+
+    wb.save(target)
+
+
+def export_excel(df, kind):
+    output = BytesIO()
+    write_excel(df, kind, output)
+    return output.getvalue()
+
+
+def get_excel_export(key, kind, df):
+    """Excel del resultado, generado solo la primera vez y guardado junto al resultado de la sesión"""
+    data = get_cached_export(key, 'xlsx')
+    if data is None:
+        data = store_export(key, 'xlsx', export_excel(df, kind))
+    return data
+
+# ============= ESTIMACIÓN ANTES DE PROCESAR =============
+
+ESTIMATE_SAMPLE = int(os.environ.get('SAT_XML_ESTIMATE_SAMPLE', 200))
+ESTIMATE_STRATA = 5
+HEADER_BYTES = 8192
+
+_TIPO_RE = re.compile(rb'TipoDeComprobante\s*=\s*["\']([A-Za-z])')
+_CONCEPTO_RE = re.compile(rb'<(?:[\w.-]+:)?Concepto[\s/>]')
+_PAGO_RE = re.compile(rb'<(?:[\w.-]+:)?Pago[\s/>]')
+_DOCTO_RE = re.compile(rb'<(?:[\w.-]+:)?DoctoRelacionado[\s/>]')
+
+# Etapas de cada procesador por separado: parseo por archivo y agregación de las filas
+ESTIMATE_STAGES = {
+    'invoices': (parse_xml_invoice_one_row, build_invoice_frame),
+    'payments': (parse_xml_payment, build_payment_frame),
+    'emitted_invoices': (parse_xml_emitted_invoice, build_emitted_invoice_frame),
+}
+# Filas con las que se cronometra la agregación; para más filas se escala en proporción
+ESTIMATE_AGGREGATE_ROWS = 50_000
+
+
+class NullProgress:
+    def update(self, done, message):
+        pass
+
+    def close(self):
+        pass
+
+
+def scan_xml_header(data):
+    """Tipo de comprobante y número de conceptos, pagos y documentos, sin construir el árbol"""
+    match = _TIPO_RE.search(data, 0, HEADER_BYTES)
+    return {
+        'tipo': match.group(1).decode('ascii').upper() if match else '?',
+        'conceptos': len(_CONCEPTO_RE.findall(data)),
+        'pagos': len(_PAGO_RE.findall(data)),
+        'doctos': len(_DOCTO_RE.findall(data)),
+    }
+
+
+def _header_rows(kind, header):
+    """Filas que aportaría el archivo según su encabezado (pagos: una por documento o por pago)"""
+    if kind == 'payments':
+        return header['doctos'] or header['pagos']
+    return 1
+
+
+def _size_strata(files, strata):
+    """Agrupa los archivos por tamaño en estratos de igual número de archivos"""
+    ordered = sorted(files, key=lambda f: getattr(f, 'size', 0) or 0)
+    bounds = np.linspace(0, len(ordered), min(strata, len(ordered)) + 1).astype(int)
+    return [ordered[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+
+def estimate_job(kind, files, sample_size=ESTIMATE_SAMPLE, seed=0):
+    """Proyecta tiempo, memoria pico y tamaño de salida de un trabajo sin procesarlo completo.
+
+    Lee el encabezado de todos los archivos para contar tipos, conceptos y filas esperadas.
+    El tiempo se proyecta por etapas, como las paga el procesamiento real: la etapa por
+    archivo (lectura y parseo) sobre una muestra aleatoria estratificada por tamaño, con el
+    tiempo por archivo de cada estrato multiplicado por su número de archivos, y la
+    agregación (DataFrame, fechas, orden) una sola vez sobre las filas proyectadas.
+    """
+    rng = random.Random(seed)
+    pool = get_parse_pool()
+    parse, build = ESTIMATE_STAGES[kind]
+
+    # Encabezados de todos los archivos
+    scan_start = time.monotonic()
+    tipos = {}
+    conceptos = 0
+    header_rows = {}
+    for f, data in iter_file_contents(files):
+        if isinstance(data, Exception):
+            header_rows[id(f)] = 0
+            continue
+        header = scan_xml_header(data)
+        tipos[header['tipo']] = tipos.get(header['tipo'], 0) + 1
+        conceptos += header['conceptos']
+        header_rows[id(f)] = _header_rows(kind, header)
+    scan_seconds = time.monotonic() - scan_start
+
+    strata = _size_strata(files, ESTIMATE_STRATA)
+    per_stratum = max(1, sample_size // max(len(strata), 1))
+    sample = []
+    sample_strata = []
+    for idx, stratum in enumerate(strata):
+        chosen = rng.sample(stratum, min(per_stratum, len(stratum)))
+        sample.extend(chosen)
+        sample_strata.extend([idx] * len(chosen))
+
+    if sample:
+        # Fuera del cronómetro: el primer parseo compila el lector del spec para el backend
+        try:
+            parse(read_file_bytes(sample[0]))
+        except Exception:
+            pass
+
+    # Etapa por archivo: una sola pasada por la muestra (el pipeline arranca una vez, como en el
+    # procesamiento real) y el tiempo entre resultados se suma al estrato de cada archivo
+    stratum_seconds = [0.0] * len(strata)
+    parsed = []
+    sources = []
+    last = time.monotonic()
+    for (f, result), idx in zip(iter_parsed_files(sample, parse, pool), sample_strata):
+        now = time.monotonic()
+        stratum_seconds[idx] += now - last
+        last = now
+        if result and not isinstance(result, Exception):
+            found = result if isinstance(result, list) else [result]
+            parsed.extend(found)
+            sources.extend([f.name] * len(found))
+    sampled = [sample_strata.count(idx) for idx in range(len(strata))]
+    parse_seconds = sum(
+        seconds / count * len(stratum)
+        for seconds, count, stratum in zip(stratum_seconds, sampled, strata) if count
+    )
+
+    sample_rows = len(parsed)
+    # Las filas del encabezado se corrigen con lo que realmente extrajo la muestra
+    sample_header_rows = sum(header_rows.get(id(f), 0) for f in sample)
+    total_header_rows = sum(header_rows.values())
+    ratio = sample_rows / sample_header_rows if sample_header_rows else 0.0
+    rows = int(round(total_header_rows * ratio))
+
+    # Agregación: las filas de la muestra repetidas hasta las proyectadas (con tope), cronometrada una vez
+    sample_df = build(parsed, sources, [])
+    aggregate_seconds = 0.0
+    if sample_rows and rows:
+        repeats = -(-min(rows, ESTIMATE_AGGREGATE_ROWS) // sample_rows)
+        start = time.monotonic()
+        build(parsed * repeats, sources * repeats, [])
+        aggregate_seconds = (time.monotonic() - start) * rows / (sample_rows * repeats)
+
+    outputs = {}
+    row_bytes = ROW_BYTES
+    if sample_rows:
+        row_bytes = sample_df.memory_usage(deep=True).sum() / sample_rows
+        outputs['xlsx'] = len(export_excel(sample_df, kind)) / sample_rows * rows
+        buffer = BytesIO()
+        sample_df.to_pickle(buffer)
+        outputs['pkl'] = len(buffer.getvalue()) / sample_rows * rows
+
+    # Memoria pico: archivos subidos + lectura anticipada + árboles en parseo + filas (lista, DataFrame y
+    # copia al ordenar) + Excel generado
+    sizes = sorted((getattr(f, 'size', 0) or 0 for f in files), reverse=True)
+    resident = sum(getattr(f, 'size', 0) or 0 for f in files if not isinstance(f, LocalXMLFile))
+    average = sum(sizes) / len(sizes) if sizes else 0
+    parsing = PARSE_WORKERS if PARSE_IN_THREADS else 1
+    peak_memory = (resident + PARSE_WINDOW * average + sum(sizes[:parsing]) * XML_TREE_FACTOR
+                   + rows * row_bytes * 3 + outputs.get('xlsx', 0))
+
+    return {
+        'files': len(files),
+        'bytes': sum(sizes),
+        'tipos': tipos,
+        'conceptos': conceptos,
+        'rows': rows,
+        'sample_files': len(sample),
+        'strata': len(strata),
+        'scan_seconds': scan_seconds,
+        'seconds': parse_seconds + aggregate_seconds,
+        'peak_memory': peak_memory,
+        'outputs': outputs,
+    }
+
+
+def format_estimate(estimate):
+    """Líneas de texto con el resumen de una estimación"""
+    mb = 1024 * 1024
+    tipos = ', '.join(f"{tipo}: {n}" for tipo, n in sorted(estimate['tipos'].items())) or '-'
+    lines = [
+        f"{estimate['files']} archivo(s), {estimate['bytes'] / mb:.1f} MB; tipos {tipos}; {estimate['conceptos']} concepto(s)",
+        f"Muestra: {estimate['sample_files']} archivo(s) en {estimate['strata']} estrato(s) por tamaño",
+        f"Tiempo estimado: ~{format_duration(estimate['seconds'])} (lectura de encabezados: {format_duration(estimate['scan_seconds'])})",
+        f"Memoria pico estimada: ~{estimate['peak_memory'] / mb:.0f} MB",
+        f"Filas estimadas: ~{estimate['rows']}",
+    ]
+    for fmt, size in estimate['outputs'].items():
+        lines.append(f"Salida {fmt}: ~{size / mb:.1f} MB")
+    return lines
+
+
+def show_estimate(key, kind, files):
+    """Muestra la estimación del conjunto de archivos, calculándola una sola vez por sesión.
+
+    La muestra y la lectura de encabezados pasan por los límites de la sesión y la cola
+    compartida igual que Procesar; si se rechaza, el mensaje también se recuerda.
+    """
+    state_key = f'_estimate_{key}'
+    outcome = st.session_state.get(state_key)
+    if outcome is None:
+        with st.spinner('Estimando...'):
+            outcome = run_in_shared_queue(lambda fs: (estimate_job(kind, fs), []), files)
+        st.session_state[state_key] = outcome
+    estimate, errors = outcome
+    for error in errors:
+        st.markdown(f'<div class="status-error">{error}</div>', unsafe_allow_html=True)
+    if estimate is not None:
+        st.markdown('<div class="status-info">' + '<br>'.join(format_estimate(estimate)) + '</div>', unsafe_allow_html=True)
+
+# ============= MODO POR LOTES (SIN INTERFAZ, POR SHARDS) =============
+#
+# Para procesar millones de CFDI en varias máquinas o procesos:
+#   python app_sat_extractor.py manifest /datos/xml -o manifest.txt
+#   python app_sat_extractor.py estimate --manifest manifest.txt --kind invoices
+#   python app_sat_extractor.py shard --manifest manifest.txt --kind invoices --shards 8 --index 3 --parts-dir parciales/
+#   python app_sat_extractor.py merge --kind invoices --parts-dir parciales/ --output Facturas.xlsx
+# o, en una sola máquina con varios procesos:
+#   python app_sat_extractor.py local --manifest manifest.txt --kind invoices --shards 4 --parts-dir parciales/ --output Facturas.xlsx
+
+BATCH_PROCESSORS = {
+    'invoices': process_invoice_files,
+    'payments': process_payment_files,
+    'emitted_invoices': process_emitted_invoice_files,
+}
+
+# Columna de fecha por la que cada resultado va ordenado y el decodificador con el que se
+# ordenó cada shard; merge_shards debe usar el mismo para que el merge no mezcle órdenes
+BATCH_SORT_COLUMNS = {
+    'invoices': ('Fecha', parse_formatted_sat_dates),
+    'payments': ('Fecha', parse_formatted_sat_dates),
+    'emitted_invoices': ('FECHA DD/MM/AA', parse_emitted_dates),
+}
+
+
+class ConsoleProgress:
+    """Misma interfaz que BatchedProgress, escribiendo en stderr"""
+
+    def __init__(self, total, label, interval=5.0):
+        self.total = max(total, 1)
+        self.label = label
+        self.interval = interval
+        self._last = 0.0
+        self._start = time.monotonic()
+
+    def update(self, done, message):
+        now = time.monotonic()
+        if done < self.total and now - self._last < self.interval:
+            return
+        self._last = now
+        eta = eta_text(self._start, done, self.total)
+        print(f"[{self.label}] {done}/{self.total} {message}{eta}", file=sys.stderr, flush=True)
+
+    def close(self):
+        pass
+
+
+def write_manifest(root_dir, manifest_path):
+    """Lista todos los XML de una carpeta en un manifiesto (una ruta por línea)"""
+    files = scan_xml_directory(root_dir)
+    with open(manifest_path, 'w', encoding='utf-8') as fh:
+        for f in files:
+            fh.write(f"{f.path}\n")
+    return len(files)
+
+
+def shard_of(path, shards):
+    """Shard de una ruta: hash estable (no depende del proceso ni de la máquina)"""
+    digest = hashlib.sha1(path.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shards
+
+
+def read_manifest_shard(manifest_path, shards, index):
+    """Archivos del manifiesto que tocan a este shard y advertencias de los que ya no se pueden leer.
+
+    Se nombran con la ruta del manifiesto para que las advertencias de distintas carpetas
+    no se confundan al unir los shards.
+    """
+    files, errors = [], []
+    with open(manifest_path, encoding='utf-8') as fh:
+        for line in fh:
+            path = line.rstrip('\n')
+            if path and shard_of(path, shards) == index:
+                try:
+                    stat = os.stat(path)
+                except OSError as e:
+                    # Borrado o movido después de generar el manifiesto
+                    errors.append(f"{path}: {e.strerror or e}")
+                    continue
+                files.append(LocalXMLFile(path, stat.st_size, stat.st_mtime_ns, name=path))
+    return files, errors
+
+
+def _part_prefix(parts_dir, kind, shards, index):
+    return os.path.join(parts_dir, f"{kind}-{index:04d}-of-{shards:04d}")
+
+
+def run_shard(manifest_path, kind, shards, index, parts_dir):
+    """Procesa un shard del manifiesto y guarda su resultado parcial (ya ordenado) y sus errores"""
+    files, missing = read_manifest_shard(manifest_path, shards, index)
+    label = f"{kind} {index + 1}/{shards}"
+    with new_parse_pool() or nullcontext() as pool:
+        df, errors = BATCH_PROCESSORS[kind](files, ConsoleProgress(len(files), label), pool)
+    errors = missing + errors
+
+    os.makedirs(parts_dir, exist_ok=True)
+    prefix = _part_prefix(parts_dir, kind, shards, index)
+    (df if df is not None else pd.DataFrame()).to_pickle(f"{prefix}.pkl.tmp")
+    with open(f"{prefix}.errors.json.tmp", 'w', encoding='utf-8') as fh:
+        json.dump(errors, fh, ensure_ascii=False)
+    # Se publica al final para que merge nunca vea un parcial a medias
+    os.replace(f"{prefix}.errors.json.tmp", f"{prefix}.errors.json")
+    os.replace(f"{prefix}.pkl.tmp", f"{prefix}.pkl")
+    return len(files), 0 if df is None else len(df), len(errors)
+
+
+def merge_shards(kind, parts_dir, shards):
+    """Une los parciales de todos los shards con un merge de k vías por fecha.
+
+    Cada parcial ya viene ordenado, así que solo se comparan las cabezas de cada shard;
+    las filas sin fecha válida quedan al final, igual que en el procesamiento normal.
+    """
+    frames, errors = [], []
+    for index in range(shards):
+        prefix = _part_prefix(parts_dir, kind, shards, index)
+        if not os.path.exists(f"{prefix}.pkl"):
+            raise FileNotFoundError(f"Falta el shard {index} de {shards}: {prefix}.pkl")
+        df = pd.read_pickle(f"{prefix}.pkl")
+        with open(f"{prefix}.errors.json", encoding='utf-8') as fh:
+            errors.extend(json.load(fh))
+        if len(df):
+            frames.append(df.reset_index(drop=True))
+
+    if not frames:
+        return None, errors
+
+    column, decode = BATCH_SORT_COLUMNS[kind]
+    last = np.iinfo(np.int64).max
+
+    def keyed(shard_idx, df):
+        fechas = decode(df[column].tolist())
+        keys = np.where(np.isnat(fechas), last, fechas.astype(np.int64))
+        return ((key, shard_idx, pos) for pos, key in enumerate(keys.tolist()))
+
+    merged = heapq.merge(*(keyed(i, df) for i, df in enumerate(frames)))
+    offsets = np.cumsum([0] + [len(df) for df in frames[:-1]])
+    order = [offsets[shard_idx] + pos for _, shard_idx, pos in merged]
+    return pd.concat(frames, ignore_index=True).iloc[order].reset_index(drop=True), errors
+
+
+def run_local(manifest_path, kind, shards, parts_dir):
+    """Lanza un proceso por shard en esta máquina y espera a que terminen todos"""
+    procs = [
+        subprocess.Popen([
+            sys.executable, os.path.abspath(__file__), 'shard',
+            '--manifest', manifest_path, '--kind', kind,
+            '--shards', str(shards), '--index', str(index), '--parts-dir', parts_dir,
+        ])
+        for index in range(shards)
+    ]
+    failed = [index for index, proc in enumerate(procs) if proc.wait() != 0]
+    if failed:
+        raise RuntimeError(f"Fallaron los shards: {failed}")
+
+
+def _write_batch_output(df, errors, kind, output):
+    if output.endswith('.pkl'):
+        df.to_pickle(output)
+    else:
+        # Se revisa antes de escribir: openpyxl no valida el límite y Excel no abriría el libro
+        if len(df) + 1 > EXCEL_MAX_ROWS:
+            raise ValueError(
+                f"{len(df)} fila(s) no caben en una hoja de Excel (máximo {EXCEL_MAX_ROWS - 1} más el "
+                f"encabezado); usa --output con extensión .pkl"
+            )
+        write_excel(df, kind, output)
+    if errors:
+        with open(f"{output}.errores.txt", 'w', encoding='utf-8') as fh:
+            fh.write('\n'.join(errors) + '\n')
+
+
+def main_batch(argv):
+    parser = argparse.ArgumentParser(prog='app_sat_extractor.py', description='Extractor SAT XML por lotes')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('manifest', help='Lista los XML de una carpeta')
+    p.add_argument('directory')
+    p.add_argument('-o', '--output', required=True)
+
+    p = commands.add_parser('estimate', help='Estima tiempo, memoria y tamaño de salida sin procesar todo')
+    p.add_argument('--manifest', required=True)
+    p.add_argument('--kind', choices=sorted(BATCH_PROCESSORS), required=True)
+    p.add_argument('--sample', type=int, default=ESTIMATE_SAMPLE)
+
+    for name in ('shard', 'merge', 'local'):
+        p = commands.add_parser(name)
+        p.add_argument('--kind', choices=sorted(BATCH_PROCESSORS), required=True)
+        p.add_argument('--shards', type=int, required=True)
+        p.add_argument('--parts-dir', required=True)
+        if name != 'merge':
+            p.add_argument('--manifest', required=True)
+        if name == 'shard':
+            p.add_argument('--index', type=int, required=True)
+        if name != 'shard':
+            p.add_argument('--output', required=True, help='.xlsx o .pkl')
+
+    args = parser.parse_args(argv)
+
+    if getattr(args, 'shards', 1) < 1:
+        parser.error("--shards debe ser al menos 1")
+    if args.command == 'shard' and not 0 <= args.index < args.shards:
+        parser.error(f"--index debe estar entre 0 y {args.shards - 1}")
+
+    if args.command == 'manifest':
+        print(f"{write_manifest(args.directory, args.output)} archivo(s) en {args.output}")
+        return 0
+
+    if args.command == 'estimate':
+        files, missing = read_manifest_shard(args.manifest, 1, 0)
+        if missing:
+            print(f"{len(missing)} archivo(s) del manifiesto ya no existen; se omiten", file=sys.stderr)
+        estimate = estimate_job(args.kind, files, args.sample)
+        print('\n'.join(format_estimate(estimate)))
+        return 0
+
+    if args.command == 'shard':
+        total, rows, errors = run_shard(args.manifest, args.kind, args.shards, args.index, args.parts_dir)
+        print(f"Shard {args.index}/{args.shards}: {total} archivo(s), {rows} fila(s), {errors} advertencia(s)")
+        return 0
+
+    if args.command == 'local':
+        run_local(args.manifest, args.kind, args.shards, args.parts_dir)
+
+    df, errors = merge_shards(args.kind, args.parts_dir, args.shards)
+    if df is None:
+        print("No se encontraron comprobantes válidos", file=sys.stderr)
+        return 1
+    try:
+        _write_batch_output(df, errors, args.kind, args.output)
+    except ValueError as e:
+        # Los parciales siguen en --parts-dir: basta repetir merge con otra salida
+        print(str(e), file=sys.stderr)
+        return 1
+    print(f"{len(df)} fila(s) en {args.output}, {len(errors)} advertencia(s)")
+    return 0
+
+
+if __name__ == '__main__' and len(sys.argv) > 1 and sys.argv[1] in ('manifest', 'estimate', 'shard', 'merge', 'local'):
+    sys.exit(main_batch(sys.argv[1:]))
+
+# ============= UI CON PESTAÑAS =============
+
 st.set_page_config(
     page_title="Extractor SAT XML",
     page_icon="📊",
@@ -178,425 +2250,6 @@ st.markdown("""
     </div>
 """, unsafe_allow_html=True)
 
-NS = {
-    'cfdi': 'http://www.sat.gob.mx/cfd/4',
-    'cfdi3': 'http://www.sat.gob.mx/cfd/3',
-    'tfd': 'http://www.sat.gob.mx/TimbreFiscalDigital',
-    'pago20': 'http://www.sat.gob.mx/Pagos20'
-}
-
-# ============= PARSERS PARA FACTURAS (RECIBIDAS) =============
-
-def parse_xml_invoice_one_row(xml_text):
-    """Parsea un XML de factura y devuelve UNA fila por factura"""
-    try:
-        root = ET.fromstring(xml_text)
-
-        fecha = root.get('Fecha', '')
-        total = float(root.get('Total', '0') or 0)
-        subtotal = float(root.get('SubTotal', '0') or 0)
-        moneda = root.get('Moneda', 'MXN')
-        tipo_comprobante = root.get('TipoDeComprobante', '')
-
-        timbre = root.find('.//tfd:TimbreFiscalDigital', NS)
-        uuid = timbre.get('UUID', '') if timbre is not None else ''
-
-        # Emisor
-        emisor = root.find('cfdi:Emisor', NS)
-        if emisor is None:
-            emisor = root.find('cfdi3:Emisor', NS)
-        if emisor is None:
-            emisor = root.find('Emisor')
-
-        emisor_rfc = ''
-        emisor_nombre = ''
-        if emisor is not None:
-            emisor_rfc = emisor.get('Rfc', '')
-            emisor_nombre = emisor.get('Nombre', '')
-
-        # Conceptos
-        conceptos = root.findall('cfdi:Conceptos/cfdi:Concepto', NS)
-        if not conceptos:
-            conceptos = root.findall('cfdi3:Conceptos/cfdi3:Concepto', NS)
-        if not conceptos:
-            conceptos = root.findall('.//Concepto')
-
-        total_cantidad = 0.0
-        total_importe = 0.0
-        iva_traslado = 0.0
-        isr_retenido = 0.0
-        iva_retenido = 0.0
-        ieps = 0.0
-        descripciones = []
-
-        for concepto in conceptos:
-            cantidad = float(concepto.get('Cantidad', '0') or 0)
-            importe = float(concepto.get('Importe', '0') or 0)
-            desc = concepto.get('Descripcion', '')
-
-            if desc:
-                descripciones.append(desc)
-
-            total_cantidad += cantidad
-            total_importe += importe
-
-            impuestos_concepto = concepto.find('cfdi:Impuestos', NS)
-            if impuestos_concepto is None:
-                impuestos_concepto = concepto.find('cfdi3:Impuestos', NS)
-            if impuestos_concepto is None:
-                impuestos_concepto = concepto.find('Impuestos')
-
-            if impuestos_concepto is not None:
-                traslados = impuestos_concepto.findall('cfdi:Traslados/cfdi:Traslado', NS)
-                if not traslados:
-                    traslados = impuestos_concepto.findall('cfdi3:Traslados/cfdi3:Traslado', NS)
-                if not traslados:
-                    traslados = impuestos_concepto.findall('.//Traslado')
-
-                for traslado in traslados:
-                    impuesto_tipo = traslado.get('Impuesto', '')
-                    importe_imp = float(traslado.get('Importe', '0') or 0)
-
-                    if impuesto_tipo == '002':
-                        iva_traslado += importe_imp
-                    elif impuesto_tipo == '003':
-                        ieps += importe_imp
-
-                retenciones = impuestos_concepto.findall('cfdi:Retenciones/cfdi:Retencion', NS)
-                if not retenciones:
-                    retenciones = impuestos_concepto.findall('cfdi3:Retenciones/cfdi3:Retencion', NS)
-                if not retenciones:
-                    retenciones = impuestos_concepto.findall('.//Retencion')
-
-                for retencion in retenciones:
-                    impuesto_tipo = retencion.get('Impuesto', '')
-                    importe_imp = float(retencion.get('Importe', '0') or 0)
-
-                    if impuesto_tipo == '001':
-                        isr_retenido += importe_imp
-                    elif impuesto_tipo == '002':
-                        iva_retenido += importe_imp
-
-        descripcion_resumen = ' | '.join(descripciones) if descripciones else ''
-
-        return {
-            'UUID': uuid,
-            'Fecha': fecha,
-            'Tipo': tipo_comprobante,
-            'RFC Emisor': emisor_rfc,
-            'Emisor': emisor_nombre,
-            'Descripcion': descripcion_resumen,
-            'Cantidad': total_cantidad,
-            'Importe': round(total_importe, 2),
-            'IVA': round(iva_traslado, 2),
-            'ISR Retenido': round(isr_retenido, 2),
-            'IVA Retenido': round(iva_retenido, 2),
-            'IEPS': round(ieps, 2),
-            'Subtotal': subtotal,
-            'Total': total,
-            'Moneda': moneda
-        }
-
-    except Exception:
-        return None
-
-# ============= PARSER PARA PAGOS =============
-
-def parse_xml_payment(xml_text):
-    """Parsea un XML de pago (Comprobante de Pago con complemento pago20)"""
-    try:
-        root = ET.fromstring(xml_text)
-
-        # Datos principales del comprobante
-        fecha_comprobante = root.get('Fecha', '')
-        folio_comprobante = root.get('Folio', '')
-
-        # Receptor
-        receptor = root.find('cfdi:Receptor', NS)
-        if receptor is None:
-            receptor = root.find('Receptor')
-
-        receptor_rfc = ''
-        receptor_nombre = ''
-        if receptor is not None:
-            receptor_rfc = receptor.get('Rfc', '')
-            receptor_nombre = receptor.get('Nombre', '')
-
-        # Buscar el complemento de pagos
-        pagos = root.find('.//pago20:Pagos', NS)
-        if pagos is None:
-            pagos = root.find('.//Pagos')
-
-        rows = []
-
-        if pagos is not None:
-            # Iterar sobre cada pago (Pago)
-            pago_list = pagos.findall('pago20:Pago', NS)
-            if not pago_list:
-                pago_list = pagos.findall('.//Pago')
-
-            for pago in pago_list:
-                fecha_pago = pago.get('FechaPago', '')
-                monto_pago = float(pago.get('Monto', '0') or 0)
-
-                # Buscar documentos relacionados dentro de este pago
-                doc_relacionados = pago.findall('pago20:DoctoRelacionado', NS)
-                if not doc_relacionados:
-                    doc_relacionados = pago.findall('.//DoctoRelacionado')
-
-                if doc_relacionados:
-                    for docto in doc_relacionados:
-                        folio_docto = docto.get('Folio', '')
-                        # CORREGIDO: leer ImpPagado correctamente
-                        monto_docto = float(
-                            docto.get('ImpPagado', '0') or
-                            docto.get('ImPagado', '0') or
-                            docto.get('MontoPagado', '0') or
-                            docto.get('MontoPagedo', '0') or
-                            0
-                        )
-
-                        rows.append({
-                            'Receptor': receptor_nombre,
-                            'Fecha': fecha_comprobante,
-                            'Mes': '',  # Se llena después
-                            'RFC Receptor': receptor_rfc,
-                            'Folio Pago': folio_comprobante,
-                            'Folio Documento': folio_docto,
-                            'Monto Pagado': round(monto_docto, 2)
-                        })
-                else:
-                    # Si no hay documentos relacionados, crear una fila con el monto del pago
-                    rows.append({
-                        'Receptor': receptor_nombre,
-                        'Fecha': fecha_comprobante,
-                        'Mes': '',  # Se llena después
-                        'RFC Receptor': receptor_rfc,
-                        'Folio Pago': folio_comprobante,
-                        'Folio Documento': '',
-                        'Monto Pagado': round(monto_pago, 2)
-                    })
-
-        return rows
-
-    except Exception:
-        return []
-
-# ============= PARSER PARA FACTURAS EMITIDAS ============= 
-
-def parse_xml_emitted_invoice(xml_text):
-    """Parsea un XML de factura emitida y devuelve UNA fila con la estructura deseada"""
-    try:
-        root = ET.fromstring(xml_text)
-
-        # Datos generales
-        fecha = root.get('Fecha', '')
-        subtotal = float(root.get('SubTotal', '0') or 0)
-        total = float(root.get('Total', '0') or 0)
-        descuento = float(root.get('Descuento', '0') or 0)
-        folio = root.get('Folio', '')
-        serie = root.get('Serie', '')
-        no_factura = f"{serie}{folio}" if serie else folio
-
-        # Receptor (cliente)
-        receptor = root.find('cfdi:Receptor', NS)
-        if receptor is None:
-            receptor = root.find('cfdi3:Receptor', NS)
-        if receptor is None:
-            receptor = root.find('Receptor')
-
-        cliente_nombre = receptor.get('Nombre', '') if receptor is not None else ''
-        cliente_rfc = receptor.get('Rfc', '') if receptor is not None else ''
-
-        # Impuestos a nivel comprobante
-        iva_trasladado = 0.0
-        iva_retenido = 0.0
-
-        impuestos = root.find('cfdi:Impuestos', NS)
-        if impuestos is None:
-            impuestos = root.find('cfdi3:Impuestos', NS)
-        if impuestos is None:
-            impuestos = root.find('Impuestos')
-
-        if impuestos is not None:
-            # Traslados
-            traslados = impuestos.findall('cfdi:Traslados/cfdi:Traslado', NS) or \
-                        impuestos.findall('cfdi3:Traslados/cfdi3:Traslado', NS) or \
-                        impuestos.findall('.//Traslado')
-            for t in traslados:
-                if t.get('Impuesto', '') == '002':
-                    iva_trasladado += float(t.get('Importe', '0') or 0)
-
-            # Retenciones
-            retenciones = impuestos.findall('cfdi:Retenciones/cfdi:Retencion', NS) or \
-                          impuestos.findall('cfdi3:Retenciones/cfdi3:Retencion', NS) or \
-                          impuestos.findall('.//Retencion')
-            for r in retenciones:
-                if r.get('Impuesto', '') == '002':
-                    iva_retenido += float(r.get('Importe', '0') or 0)
-
-        # Estatus básico (luego puedes enriquecerlo)
-        estatus = 'Emitida'
-
-        # Formato fecha dd/mm/aa
-        try:
-            fecha_dt = pd.to_datetime(fecha, errors='coerce')
-            fecha_fmt = fecha_dt.strftime('%d/%m/%y') if pd.notnull(fecha_dt) else fecha
-        except Exception:
-            fecha_fmt = fecha
-
-        return {
-            'FECHA DD/MM/AA': fecha_fmt,
-            'CLIENTE': cliente_nombre,
-            'RFC': cliente_rfc,
-            'No FACTURA': no_factura,
-            'ESTATUS': estatus,
-            'Subtotal': round(subtotal, 2),
-            'OTRO (DESCUENTO)': round(descuento, 2),
-            'IVA': round(iva_trasladado, 2),
-            'RET IVA': round(iva_retenido, 2),
-            'TOTAL': round(total, 2),
-        }
-    except Exception:
-        return None
-
-# ============= PROCESADORES DE ARCHIVOS =============
-
-def process_invoice_files(uploaded_files):
-    """Procesa múltiples archivos XML de facturas"""
-    all_invoices = []
-    errors = []
-
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-
-    for idx, uploaded_file in enumerate(uploaded_files):
-        try:
-            xml_content = uploaded_file.read().decode('utf-8', errors='ignore')
-            invoice = parse_xml_invoice_one_row(xml_content)
-
-            if invoice:
-                all_invoices.append(invoice)
-                status_text.text(f"Procesado: {uploaded_file.name}")
-            else:
-                errors.append(f"{uploaded_file.name}: No se pudo extraer información")
-
-            progress_bar.progress((idx + 1) / len(uploaded_files))
-
-        except Exception as e:
-            errors.append(f"{uploaded_file.name}: {str(e)}")
-
-    progress_bar.empty()
-    status_text.empty()
-
-    if all_invoices:
-        df = pd.DataFrame(all_invoices)
-        df['Fecha'] = pd.to_datetime(df['Fecha'], errors='coerce')
-        df = df.sort_values('Fecha').reset_index(drop=True)
-        df['Fecha'] = df['Fecha'].dt.strftime('%Y-%m-%d %H:%M:%S')
-
-        # Reordenar columnas según el orden deseado
-        columnas_ordenadas = ['UUID', 'Tipo', 'Fecha', 'Emisor', 'RFC Emisor', 'Descripcion', 
-                              'Subtotal', 'IVA', 'IVA Retenido', 'ISR Retenido', 'IEPS', 'Total']
-        df = df[columnas_ordenadas]
-
-        return df, errors
-
-    return None, errors
-
-def process_payment_files(uploaded_files):
-    """Procesa múltiples archivos XML de pagos"""
-    all_payments = []
-    errors = []
-
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-
-    for idx, uploaded_file in enumerate(uploaded_files):
-        try:
-            xml_content = uploaded_file.read().decode('utf-8', errors='ignore')
-            payments = parse_xml_payment(xml_content)
-
-            if payments:
-                all_payments.extend(payments)
-                status_text.text(f"Procesado: {uploaded_file.name} ({len(payments)} pago(s))")
-            else:
-                errors.append(f"{uploaded_file.name}: No se encontraron pagos")
-
-            progress_bar.progress((idx + 1) / len(uploaded_files))
-
-        except Exception as e:
-            errors.append(f"{uploaded_file.name}: {str(e)}")
-
-    progress_bar.empty()
-    status_text.empty()
-
-    if all_payments:
-        df = pd.DataFrame(all_payments)
-        df['Fecha'] = pd.to_datetime(df['Fecha'], errors='coerce')
-        df = df.sort_values('Fecha').reset_index(drop=True)
-
-        # Agregar mes según la fecha
-        meses = {
-            1: 'Enero', 2: 'Febrero', 3: 'Marzo', 4: 'Abril',
-            5: 'Mayo', 6: 'Junio', 7: 'Julio', 8: 'Agosto',
-            9: 'Septiembre', 10: 'Octubre', 11: 'Noviembre', 12: 'Diciembre'
-        }
-        df['Mes'] = df['Fecha'].dt.month.map(meses)
-
-        # Convertir fecha a string
-        df['Fecha'] = df['Fecha'].dt.strftime('%Y-%m-%d %H:%M:%S')
-
-        # Reordenar columnas: Receptor, Fecha, Mes, RFC Receptor, ...
-        columnas_ordenadas = ['Receptor', 'Fecha', 'Mes', 'RFC Receptor', 'Folio Pago', 'Folio Documento', 'Monto Pagado']
-        df = df[columnas_ordenadas]
-
-        return df, errors
-
-    return None, errors
-
-def process_emitted_invoice_files(uploaded_files):
-    """Procesa múltiples archivos XML de facturas emitidas"""
-    all_rows = []
-    errors = []
-
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-
-    for idx, uploaded_file in enumerate(uploaded_files):
-        try:
-            xml_content = uploaded_file.read().decode('utf-8', errors='ignore')
-            row = parse_xml_emitted_invoice(xml_content)
-
-            if row:
-                all_rows.append(row)
-                status_text.text(f"Procesado: {uploaded_file.name}")
-            else:
-                errors.append(f"{uploaded_file.name}: No se pudo extraer información")
-
-            progress_bar.progress((idx + 1) / len(uploaded_files))
-
-        except Exception as e:
-            errors.append(f"{uploaded_file.name}: {str(e)}")
-
-    progress_bar.empty()
-    status_text.empty()
-
-    if all_rows:
-        df = pd.DataFrame(all_rows)
-        # Ordenar por fecha si se pudo parsear
-        try:
-            df['_fecha_sort'] = pd.to_datetime(df['FECHA DD/MM/AA'], dayfirst=True, errors='coerce')
-            df = df.sort_values('_fecha_sort').drop(columns=['_fecha_sort'])
-        except Exception:
-            pass
-        df = df.reset_index(drop=True)
-        return df, errors
-
-    return None, errors
-
-# ============= UI CON PESTAÑAS =============
-
 tab1, tab2, tab3 = st.tabs(["📄 Facturas Recibidas", "💰 Pagos", "📤 Facturas emitidas"])
 
 # ============= PESTAÑA 1: FACTURAS (RECIBIDAS) =============
@@ -612,10 +2265,12 @@ with tab1:
         help="Arrastra o selecciona múltiples archivos XML"
     )
 
-    if uploaded_files_inv:
-        st.markdown(f'<div class="status-info">{len(uploaded_files_inv)} archivo(s) seleccionado(s)</div>', unsafe_allow_html=True)
+    files_inv = uploaded_files_inv or local_directory_input("invoices")
+
+    if files_inv:
+        st.markdown(f'<div class="status-info">{len(files_inv)} archivo(s) seleccionado(s)</div>', unsafe_allow_html=True)
 
-        col1, col2 = st.columns([2, 2])
+        col1, col2, col3 = st.columns([2, 2, 2])
 
         with col1:
             process_btn = st.button('Procesar y Descargar', type="primary", use_container_width=True, key="proc_inv")
@@ -623,36 +2278,27 @@ with tab1:
         with col2:
             preview_btn = st.button('Vista Previa', type="secondary", use_container_width=True, key="prev_inv")
 
-        if process_btn:
+        with col3:
+            estimate_btn = st.button('Estimar', type="secondary", use_container_width=True, key="est_inv")
+
+        result_inv = result_key("invoices", files_inv)
+        views_inv = active_views("inv", result_inv, process_btn, preview_btn, estimate_btn)
+
+        if 'estimate' in views_inv:
+            show_estimate(result_inv, "invoices", files_inv)
+
+        if 'download' in views_inv:
             with st.spinner('Procesando facturas...'):
-                df, errors = process_invoice_files(uploaded_files_inv)
+                df, errors = get_results(result_inv, process_invoice_files, files_inv)
 
             if df is not None and len(df) > 0:
-                output = BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    df.to_excel(writer, sheet_name='Facturas', index=False)
-
-                    worksheet = writer.sheets['Facturas']
-                    column_widths = {
-                        'UUID': 40, 'Fecha': 20, 'Tipo': 8, 'RFC Emisor': 15,
-                        'Emisor': 35, 'Descripcion': 60, 'Cantidad': 12,
-                        'Importe': 12, 'IVA': 12, 'ISR Retenido': 15,
-                        'IVA Retenido': 15, 'IEPS': 12, 'Subtotal': 12,
-                        'Total': 12, 'Moneda': 10
-                    }
-
-                    for idx, col in enumerate(df.columns):
-                        width = column_widths.get(col, 20)
-                        col_letter = chr(65 + idx) if idx < 26 else chr(65 + idx // 26 - 1) + chr(65 + idx % 26)
-                        worksheet.column_dimensions[col_letter].width = width
-
-                output.seek(0)
+                excel_inv = get_excel_export(result_inv, 'invoices', df)
 
                 st.markdown(f'<div class="status-success">{len(df)} factura(s) procesada(s) y ordenada(s) cronológicamente</div>', unsafe_allow_html=True)
 
                 st.download_button(
                     label="Descargar Excel",
-                    data=output.getvalue(),
+                    data=excel_inv,
                     file_name=f"Facturas_SAT_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
                     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                     use_container_width=True
@@ -669,8 +2315,8 @@ with tab1:
                     for error in errors:
                         st.error(error)
 
-        if preview_btn:
-            df, errors = process_invoice_files(uploaded_files_inv)
+        if 'preview' in views_inv:
+            df, errors = get_results(result_inv, process_invoice_files, files_inv)
 
             if df is not None and len(df) > 0:
                 st.markdown("### Vista Previa (Ordenada cronológicamente)")
@@ -697,10 +2343,12 @@ with tab2:
         help="Arrastra o selecciona múltiples archivos XML de pagos"
     )
 
-    if uploaded_files_pay:
-        st.markdown(f'<div class="status-info">{len(uploaded_files_pay)} archivo(s) seleccionado(s)</div>', unsafe_allow_html=True)
+    files_pay = uploaded_files_pay or local_directory_input("payments")
 
-        col1, col2 = st.columns([2, 2])
+    if files_pay:
+        st.markdown(f'<div class="status-info">{len(files_pay)} archivo(s) seleccionado(s)</div>', unsafe_allow_html=True)
+
+        col1, col2, col3 = st.columns([2, 2, 2])
 
         with col1:
             process_btn_pay = st.button('Procesar y Descargar', type="primary", use_container_width=True, key="proc_pay")
@@ -708,33 +2356,27 @@ with tab2:
         with col2:
             preview_btn_pay = st.button('Vista Previa', type="secondary", use_container_width=True, key="prev_pay")
 
-        if process_btn_pay:
-            with st.spinner('Procesando pagos...'):
-                df_pay, errors_pay = process_payment_files(uploaded_files_pay)
+        with col3:
+            estimate_btn_pay = st.button('Estimar', type="secondary", use_container_width=True, key="est_pay")
 
-            if df_pay is not None and len(df_pay) > 0:
-                output_pay = BytesIO()
-                with pd.ExcelWriter(output_pay, engine='openpyxl') as writer:
-                    df_pay.to_excel(writer, sheet_name='Pagos', index=False)
+        result_pay = result_key("payments", files_pay)
+        views_pay = active_views("pay", result_pay, process_btn_pay, preview_btn_pay, estimate_btn_pay)
 
-                    worksheet = writer.sheets['Pagos']
-                    column_widths = {
-                        'Receptor': 35, 'Fecha': 20, 'Mes': 12, 'RFC Receptor': 15,
-                        'Folio Pago': 15, 'Folio Documento': 15, 'Monto Pagado': 15
-                    }
+        if 'estimate' in views_pay:
+            show_estimate(result_pay, "payments", files_pay)
 
-                    for idx, col in enumerate(df_pay.columns):
-                        width = column_widths.get(col, 20)
-                        col_letter = chr(65 + idx) if idx < 26 else chr(65 + idx // 26 - 1) + chr(65 + idx % 26)
-                        worksheet.column_dimensions[col_letter].width = width
+        if 'download' in views_pay:
+            with st.spinner('Procesando pagos...'):
+                df_pay, errors_pay = get_results(result_pay, process_payment_files, files_pay)
 
-                output_pay.seek(0)
+            if df_pay is not None and len(df_pay) > 0:
+                excel_pay = get_excel_export(result_pay, 'payments', df_pay)
 
                 st.markdown(f'<div class="status-success">{len(df_pay)} pago(s) procesado(s) y ordenado(s) cronológicamente</div>', unsafe_allow_html=True)
 
                 st.download_button(
                     label="Descargar Excel",
-                    data=output_pay.getvalue(),
+                    data=excel_pay,
                     file_name=f"Pagos_SAT_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
                     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                     use_container_width=True
@@ -751,8 +2393,8 @@ with tab2:
                     for error in errors_pay:
                         st.error(error)
 
-        if preview_btn_pay:
-            df_pay, errors_pay = process_payment_files(uploaded_files_pay)
+        if 'preview' in views_pay:
+            df_pay, errors_pay = get_results(result_pay, process_payment_files, files_pay)
 
             if df_pay is not None and len(df_pay) > 0:
                 st.markdown("### Vista Previa (Ordenada cronológicamente)")
@@ -779,13 +2421,15 @@ with tab3:
         help="Arrastra o selecciona múltiples archivos XML emitidos"
     )
 
-    if uploaded_files_emit:
+    files_emit = uploaded_files_emit or local_directory_input("emitted_invoices")
+
+    if files_emit:
         st.markdown(
-            f'<div class="status-info">{len(uploaded_files_emit)} archivo(s) seleccionado(s)</div>',
+            f'<div class="status-info">{len(files_emit)} archivo(s) seleccionado(s)</div>',
             unsafe_allow_html=True
         )
 
-        col1, col2 = st.columns([2, 2])
+        col1, col2, col3 = st.columns([2, 2, 2])
 
         with col1:
             process_btn_emit = st.button(
@@ -803,34 +2447,26 @@ with tab3:
                 key="prev_emit"
             )
 
-        if process_btn_emit:
+        with col3:
+            estimate_btn_emit = st.button(
+                'Estimar',
+                type="secondary",
+                use_container_width=True,
+                key="est_emit"
+            )
+
+        result_emit = result_key("emitted_invoices", files_emit)
+        views_emit = active_views("emit", result_emit, process_btn_emit, preview_btn_emit, estimate_btn_emit)
+
+        if 'estimate' in views_emit:
+            show_estimate(result_emit, "emitted_invoices", files_emit)
+
+        if 'download' in views_emit:
             with st.spinner('Procesando facturas emitidas...'):
-                df_emit, errors_emit = process_emitted_invoice_files(uploaded_files_emit)
+                df_emit, errors_emit = get_results(result_emit, process_emitted_invoice_files, files_emit)
 
             if df_emit is not None and len(df_emit) > 0:
-                output_emit = BytesIO()
-                with pd.ExcelWriter(output_emit, engine='openpyxl') as writer:
-                    df_emit.to_excel(writer, sheet_name='Facturas emitidas', index=False)
-
-                    worksheet = writer.sheets['Facturas emitidas']
-                    column_widths = {
-                        'FECHA DD/MM/AA': 18,
-                        'CLIENTE': 35,
-                        'RFC': 15,
-                        'No FACTURA': 15,
-                        'ESTATUS': 12,
-                        'Subtotal': 14,
-                        'OTRO (DESCUENTO)': 18,
-                        'IVA': 12,
-                        'RET IVA': 12,
-                        'TOTAL': 14,
-                    }
-                    for idx, col in enumerate(df_emit.columns):
-                        width = column_widths.get(col, 20)
-                        col_letter = chr(65 + idx) if idx < 26 else chr(65 + idx // 26 - 1) + chr(65 + idx % 26)
-                        worksheet.column_dimensions[col_letter].width = width
-
-                output_emit.seek(0)
+                excel_emit = get_excel_export(result_emit, 'emitted_invoices', df_emit)
 
                 st.markdown(
                     f'<div class="status-success">{len(df_emit)} factura(s) emitida(s) procesada(s)</div>',
@@ -839,7 +2475,7 @@ with tab3:
 
                 st.download_button(
                     label="Descargar Excel",
-                    data=output_emit.getvalue(),
+                    data=excel_emit,
                     file_name=f"Facturas_emitidas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
                     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                     use_container_width=True
@@ -859,8 +2495,8 @@ with tab3:
                     for error in errors_emit:
                         st.error(error)
 
-        if preview_btn_emit:
-            df_emit, errors_emit = process_emitted_invoice_files(uploaded_files_emit)
+        if 'preview' in views_emit:
+            df_emit, errors_emit = get_results(result_emit, process_emitted_invoice_files, files_emit)
 
             if df_emit is not None and len(df_emit) > 0:
                 st.markdown("### Vista Previa")
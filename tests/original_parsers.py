@@ -0,0 +1,290 @@
+"""Parsers escritos a mano anteriores a ExtractionSpec, copiados tal cual de la app original.
+
+Sólo sirven de referencia de rendimiento en test_parser_speed.py (la referencia de salida es
+fixtures/salida_original.json).
+"""
+
+import xml.etree.ElementTree as ET
+
+import pandas as pd
+
+NS = {
+    'cfdi': 'http://www.sat.gob.mx/cfd/4',
+    'cfdi3': 'http://www.sat.gob.mx/cfd/3',
+    'tfd': 'http://www.sat.gob.mx/TimbreFiscalDigital',
+    'pago20': 'http://www.sat.gob.mx/Pagos20'
+}
+
+
+def parse_xml_invoice_one_row(xml_text):
+    """Parsea un XML de factura y devuelve UNA fila por factura"""
+    try:
+        root = ET.fromstring(xml_text)
+
+        fecha = root.get('Fecha', '')
+        total = float(root.get('Total', '0') or 0)
+        subtotal = float(root.get('SubTotal', '0') or 0)
+        moneda = root.get('Moneda', 'MXN')
+        tipo_comprobante = root.get('TipoDeComprobante', '')
+
+        timbre = root.find('.//tfd:TimbreFiscalDigital', NS)
+        uuid = timbre.get('UUID', '') if timbre is not None else ''
+
+        # Emisor
+        emisor = root.find('cfdi:Emisor', NS)
+        if emisor is None:
+            emisor = root.find('cfdi3:Emisor', NS)
+        if emisor is None:
+            emisor = root.find('Emisor')
+
+        emisor_rfc = ''
+        emisor_nombre = ''
+        if emisor is not None:
+            emisor_rfc = emisor.get('Rfc', '')
+            emisor_nombre = emisor.get('Nombre', '')
+
+        # Conceptos
+        conceptos = root.findall('cfdi:Conceptos/cfdi:Concepto', NS)
+        if not conceptos:
+            conceptos = root.findall('cfdi3:Conceptos/cfdi3:Concepto', NS)
+        if not conceptos:
+            conceptos = root.findall('.//Concepto')
+
+        total_cantidad = 0.0
+        total_importe = 0.0
+        iva_traslado = 0.0
+        isr_retenido = 0.0
+        iva_retenido = 0.0
+        ieps = 0.0
+        descripciones = []
+
+        for concepto in conceptos:
+            cantidad = float(concepto.get('Cantidad', '0') or 0)
+            importe = float(concepto.get('Importe', '0') or 0)
+            desc = concepto.get('Descripcion', '')
+
+            if desc:
+                descripciones.append(desc)
+
+            total_cantidad += cantidad
+            total_importe += importe
+
+            impuestos_concepto = concepto.find('cfdi:Impuestos', NS)
+            if impuestos_concepto is None:
+                impuestos_concepto = concepto.find('cfdi3:Impuestos', NS)
+            if impuestos_concepto is None:
+                impuestos_concepto = concepto.find('Impuestos')
+
+            if impuestos_concepto is not None:
+                traslados = impuestos_concepto.findall('cfdi:Traslados/cfdi:Traslado', NS)
+                if not traslados:
+                    traslados = impuestos_concepto.findall('cfdi3:Traslados/cfdi3:Traslado', NS)
+                if not traslados:
+                    traslados = impuestos_concepto.findall('.//Traslado')
+
+                for traslado in traslados:
+                    impuesto_tipo = traslado.get('Impuesto', '')
+                    importe_imp = float(traslado.get('Importe', '0') or 0)
+
+                    if impuesto_tipo == '002':
+                        iva_traslado += importe_imp
+                    elif impuesto_tipo == '003':
+                        ieps += importe_imp
+
+                retenciones = impuestos_concepto.findall('cfdi:Retenciones/cfdi:Retencion', NS)
+                if not retenciones:
+                    retenciones = impuestos_concepto.findall('cfdi3:Retenciones/cfdi3:Retencion', NS)
+                if not retenciones:
+                    retenciones = impuestos_concepto.findall('.//Retencion')
+
+                for retencion in retenciones:
+                    impuesto_tipo = retencion.get('Impuesto', '')
+                    importe_imp = float(retencion.get('Importe', '0') or 0)
+
+                    if impuesto_tipo == '001':
+                        isr_retenido += importe_imp
+                    elif impuesto_tipo == '002':
+                        iva_retenido += importe_imp
+
+        descripcion_resumen = ' | '.join(descripciones) if descripciones else ''
+
+        return {
+            'UUID': uuid,
+            'Fecha': fecha,
+            'Tipo': tipo_comprobante,
+            'RFC Emisor': emisor_rfc,
+            'Emisor': emisor_nombre,
+            'Descripcion': descripcion_resumen,
+            'Cantidad': total_cantidad,
+            'Importe': round(total_importe, 2),
+            'IVA': round(iva_traslado, 2),
+            'ISR Retenido': round(isr_retenido, 2),
+            'IVA Retenido': round(iva_retenido, 2),
+            'IEPS': round(ieps, 2),
+            'Subtotal': subtotal,
+            'Total': total,
+            'Moneda': moneda
+        }
+
+    except Exception:
+        return None
+
+# ============= PARSER PARA PAGOS =============
+
+def parse_xml_payment(xml_text):
+    """Parsea un XML de pago (Comprobante de Pago con complemento pago20)"""
+    try:
+        root = ET.fromstring(xml_text)
+
+        # Datos principales del comprobante
+        fecha_comprobante = root.get('Fecha', '')
+        folio_comprobante = root.get('Folio', '')
+
+        # Receptor
+        receptor = root.find('cfdi:Receptor', NS)
+        if receptor is None:
+            receptor = root.find('Receptor')
+
+        receptor_rfc = ''
+        receptor_nombre = ''
+        if receptor is not None:
+            receptor_rfc = receptor.get('Rfc', '')
+            receptor_nombre = receptor.get('Nombre', '')
+
+        # Buscar el complemento de pagos
+        pagos = root.find('.//pago20:Pagos', NS)
+        if pagos is None:
+            pagos = root.find('.//Pagos')
+
+        rows = []
+
+        if pagos is not None:
+            # Iterar sobre cada pago (Pago)
+            pago_list = pagos.findall('pago20:Pago', NS)
+            if not pago_list:
+                pago_list = pagos.findall('.//Pago')
+
+            for pago in pago_list:
+                fecha_pago = pago.get('FechaPago', '')
+                monto_pago = float(pago.get('Monto', '0') or 0)
+
+                # Buscar documentos relacionados dentro de este pago
+                doc_relacionados = pago.findall('pago20:DoctoRelacionado', NS)
+                if not doc_relacionados:
+                    doc_relacionados = pago.findall('.//DoctoRelacionado')
+
+                if doc_relacionados:
+                    for docto in doc_relacionados:
+                        folio_docto = docto.get('Folio', '')
+                        # CORREGIDO: leer ImpPagado correctamente
+                        monto_docto = float(
+                            docto.get('ImpPagado', '0') or
+                            docto.get('ImPagado', '0') or
+                            docto.get('MontoPagado', '0') or
+                            docto.get('MontoPagedo', '0') or
+                            0
+                        )
+
+                        rows.append({
+                            'Receptor': receptor_nombre,
+                            'Fecha': fecha_comprobante,
+                            'Mes': '',  # Se llena después
+                            'RFC Receptor': receptor_rfc,
+                            'Folio Pago': folio_comprobante,
+                            'Folio Documento': folio_docto,
+                            'Monto Pagado': round(monto_docto, 2)
+                        })
+                else:
+                    # Si no hay documentos relacionados, crear una fila con el monto del pago
+                    rows.append({
+                        'Receptor': receptor_nombre,
+                        'Fecha': fecha_comprobante,
+                        'Mes': '',  # Se llena después
+                        'RFC Receptor': receptor_rfc,
+                        'Folio Pago': folio_comprobante,
+                        'Folio Documento': '',
+                        'Monto Pagado': round(monto_pago, 2)
+                    })
+
+        return rows
+
+    except Exception:
+        return []
+
+# ============= PARSER PARA FACTURAS EMITIDAS ============= 
+
+def parse_xml_emitted_invoice(xml_text):
+    """Parsea un XML de factura emitida y devuelve UNA fila con la estructura deseada"""
+    try:
+        root = ET.fromstring(xml_text)
+
+        # Datos generales
+        fecha = root.get('Fecha', '')
+        subtotal = float(root.get('SubTotal', '0') or 0)
+        total = float(root.get('Total', '0') or 0)
+        descuento = float(root.get('Descuento', '0') or 0)
+        folio = root.get('Folio', '')
+        serie = root.get('Serie', '')
+        no_factura = f"{serie}{folio}" if serie else folio
+
+        # Receptor (cliente)
+        receptor = root.find('cfdi:Receptor', NS)
+        if receptor is None:
+            receptor = root.find('cfdi3:Receptor', NS)
+        if receptor is None:
+            receptor = root.find('Receptor')
+
+        cliente_nombre = receptor.get('Nombre', '') if receptor is not None else ''
+        cliente_rfc = receptor.get('Rfc', '') if receptor is not None else ''
+
+        # Impuestos a nivel comprobante
+        iva_trasladado = 0.0
+        iva_retenido = 0.0
+
+        impuestos = root.find('cfdi:Impuestos', NS)
+        if impuestos is None:
+            impuestos = root.find('cfdi3:Impuestos', NS)
+        if impuestos is None:
+            impuestos = root.find('Impuestos')
+
+        if impuestos is not None:
+            # Traslados
+            traslados = impuestos.findall('cfdi:Traslados/cfdi:Traslado', NS) or \
+                        impuestos.findall('cfdi3:Traslados/cfdi3:Traslado', NS) or \
+                        impuestos.findall('.//Traslado')
+            for t in traslados:
+                if t.get('Impuesto', '') == '002':
+                    iva_trasladado += float(t.get('Importe', '0') or 0)
+
+            # Retenciones
+            retenciones = impuestos.findall('cfdi:Retenciones/cfdi:Retencion', NS) or \
+                          impuestos.findall('cfdi3:Retenciones/cfdi3:Retencion', NS) or \
+                          impuestos.findall('.//Retencion')
+            for r in retenciones:
+                if r.get('Impuesto', '') == '002':
+                    iva_retenido += float(r.get('Importe', '0') or 0)
+
+        # Estatus básico (luego puedes enriquecerlo)
+        estatus = 'Emitida'
+
+        # Formato fecha dd/mm/aa
+        try:
+            fecha_dt = pd.to_datetime(fecha, errors='coerce')
+            fecha_fmt = fecha_dt.strftime('%d/%m/%y') if pd.notnull(fecha_dt) else fecha
+        except Exception:
+            fecha_fmt = fecha
+
+        return {
+            'FECHA DD/MM/AA': fecha_fmt,
+            'CLIENTE': cliente_nombre,
+            'RFC': cliente_rfc,
+            'No FACTURA': no_factura,
+            'ESTATUS': estatus,
+            'Subtotal': round(subtotal, 2),
+            'OTRO (DESCUENTO)': round(descuento, 2),
+            'IVA': round(iva_trasladado, 2),
+            'RET IVA': round(iva_retenido, 2),
+            'TOTAL': round(total, 2),
+        }
+    except Exception:
+        return None
@@ -0,0 +1,49 @@
+"""Reruns de la interfaz: un resultado desalojado no se reprocesa sin un clic"""
+
+from pathlib import Path
+
+from streamlit.testing.v1 import AppTest
+
+APP = str(Path(__file__).resolve().parent.parent / 'app_sat_extractor.py')
+FIXTURES = Path(__file__).parent / 'fixtures'
+
+
+def cached_frames(at):
+    cache = at.session_state['_result_cache']
+    return {key[0]: id(entry['df']) for key, entry in cache._entries.items()}
+
+
+def test_evicted_results_are_not_reprocessed_on_rerun(monkeypatch):
+    monkeypatch.setenv('SAT_XML_LOCAL_ROOT', str(FIXTURES.parent))
+    # Sin espacio en la caché: cada resultado nuevo desaloja al anterior
+    monkeypatch.setenv('SAT_XML_RESULTS_MB', '0')
+
+    at = AppTest.from_file(APP, default_timeout=60).run()
+    at.text_input(key='invoices_local_dir').input(FIXTURES.name).run()
+    at.button(key='proc_inv').click().run()
+    at.text_input(key='payments_local_dir').input(FIXTURES.name).run()
+    at.button(key='proc_pay').click().run()
+    assert not at.exception
+    assert set(cached_frames(at)) == {'payments'}
+
+    # Rerun sin clic: las facturas ya no están en caché, su vista se cierra y los pagos no se tocan
+    before = cached_frames(at)
+    at.run()
+    assert cached_frames(at) == before
+    assert any('liberaron de memoria' in md.value for md in at.markdown)
+
+    at.run()
+    assert cached_frames(at) == before
+    assert not any('liberaron de memoria' in md.value for md in at.markdown)
+
+
+def test_estimate_respects_session_limits(monkeypatch):
+    monkeypatch.setenv('SAT_XML_LOCAL_ROOT', str(FIXTURES.parent))
+    monkeypatch.setenv('SAT_XML_MEMORY_MB', '0')
+
+    at = AppTest.from_file(APP, default_timeout=60).run()
+    at.text_input(key='invoices_local_dir').input(FIXTURES.name).run()
+    at.button(key='est_inv').click().run()
+    assert not at.exception
+    assert any('máximo por sesión' in md.value for md in at.markdown)
+    assert not any('Tiempo estimado' in md.value for md in at.markdown)
@@ -0,0 +1,46 @@
+"""Los backends etree y lxml deben producir exactamente la misma salida"""
+
+from pathlib import Path
+
+import pytest
+
+import app_sat_extractor as app
+
+FIXTURES = sorted((Path(__file__).parent / 'fixtures').glob('*.xml'))
+
+requires_lxml = pytest.mark.skipif(app.LET is None, reason='lxml no está instalado')
+
+
+@requires_lxml
+@pytest.mark.parametrize('kind', sorted(app.XML_PARSERS))
+@pytest.mark.parametrize('fixture', FIXTURES, ids=lambda path: path.name)
+def test_backends_match(fixture, kind):
+    parse = app.XML_PARSERS[kind]
+    raw = fixture.read_bytes()
+    assert parse(raw, app.LxmlBackend()) == parse(raw, app.EtreeBackend())
+
+
+@requires_lxml
+@pytest.mark.parametrize('backend', ['etree', 'lxml'])
+@pytest.mark.parametrize('fixture', [f for f in FIXTURES if f.name != 'latin1.xml'], ids=lambda path: path.name)
+def test_text_and_bytes_match(fixture, backend):
+    # Los bytes se parsean directo; el texto ya decodificado debe dar lo mismo
+    # (latin1.xml declara otra codificación, que solo se respeta al leer bytes)
+    backend = app.get_xml_backend(backend)
+    raw = fixture.read_bytes()
+    text = raw.decode('utf-8', errors='ignore')
+    for parse in app.XML_PARSERS.values():
+        assert parse(raw, backend) == parse(text, backend)
+
+
+def test_benchmark_reports_no_mismatches():
+    texts = [fixture.read_bytes() for fixture in FIXTURES]
+    throughput, mismatches = app.benchmark_xml_backends(texts, repeat=1)
+    assert mismatches == []
+    expected = {'etree', 'lxml'} if app.LET is not None else {'etree'}
+    assert set(throughput) == expected
+
+
+def test_default_backend_honours_env(monkeypatch):
+    monkeypatch.setenv('SAT_XML_BACKEND', 'etree')
+    assert app.get_xml_backend().name == 'etree'
@@ -0,0 +1,106 @@
+"""Modo por lotes: manifiestos con archivos faltantes y validación de argumentos."""
+
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app_sat_extractor as app
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def test_missing_manifest_file_is_a_warning(tmp_path):
+    kept = tmp_path / 'a' / 'factura.xml'
+    gone = tmp_path / 'b' / 'factura.xml'
+    for target in (kept, gone):
+        target.parent.mkdir()
+        shutil.copy(os.path.join(FIXTURES, 'cfdi40_factura.xml'), target)
+    manifest = tmp_path / 'manifest.txt'
+    app.write_manifest(str(tmp_path), str(manifest))
+    gone.unlink()
+
+    files, missing = app.read_manifest_shard(str(manifest), 1, 0)
+    assert [f.name for f in files] == [str(kept)]
+    assert len(missing) == 1 and missing[0].startswith(f"{gone}: ")
+
+    parts = tmp_path / 'parts'
+    total, rows, warnings = app.run_shard(str(manifest), 'invoices', 1, 0, str(parts))
+    assert (total, rows) == (1, 1)
+    df, errors = app.merge_shards('invoices', str(parts), 1)
+    assert len(df) == 1
+    assert errors[0] == missing[0]
+    assert warnings == len(errors)
+
+
+@pytest.mark.parametrize('argv', [
+    ['--shards', '4', '--index', '4'],
+    ['--shards', '4', '--index', '-1'],
+    ['--shards', '0', '--index', '0'],
+])
+def test_shard_index_is_validated(tmp_path, argv):
+    base = ['shard', '--kind', 'invoices', '--manifest', str(tmp_path / 'm.txt'), '--parts-dir', str(tmp_path)]
+    with pytest.raises(SystemExit) as exc:
+        app.main_batch(base + argv)
+    assert exc.value.code == 2
+    assert not list(tmp_path.iterdir())
+
+
+def test_merge_keeps_date_order_across_shards(tmp_path):
+    manifest = tmp_path / 'manifest.txt'
+    app.write_manifest(FIXTURES, str(manifest))
+    for index in range(3):
+        app.run_shard(str(manifest), 'payments', 3, index, str(tmp_path))
+    df, _ = app.merge_shards('payments', str(tmp_path), 3)
+    fechas = pd.to_datetime(df['Fecha'], format='%Y-%m-%d %H:%M:%S', errors='coerce').dropna()
+    assert fechas.is_monotonic_increasing
+
+
+def write_part(parts_dir, kind, shards, index, df):
+    prefix = app._part_prefix(str(parts_dir), kind, shards, index)
+    df.to_pickle(f"{prefix}.pkl")
+    with open(f"{prefix}.errors.json", 'w', encoding='utf-8') as fh:
+        fh.write('[]')
+
+
+@pytest.mark.parametrize('kind, column, shard_dates', [
+    ('payments', 'Fecha', [
+        ['0001-01-01 00:00:00', '2024-05-01 00:00:00', None],
+        ['1500-06-15 12:00:00', '9999-12-31 23:59:59'],
+    ]),
+    ('emitted_invoices', 'FECHA DD/MM/AA', [
+        ['01/02/69', '31/12/68', 'sin fecha'],
+        ['15/06/99', '01/01/00'],
+    ]),
+])
+def test_merge_decodes_dates_like_the_shards(tmp_path, kind, column, shard_dates):
+    decode = app.BATCH_SORT_COLUMNS[kind][1]
+    for index, dates in enumerate(shard_dates):
+        # Cada shard llega ordenado con el decodificador de su procesador
+        order = np.argsort(decode(dates), kind='stable')
+        write_part(tmp_path, kind, len(shard_dates), index, pd.DataFrame({column: [dates[i] for i in order]}))
+
+    df, _ = app.merge_shards(kind, str(tmp_path), len(shard_dates))
+    merged = df[column].tolist()
+    keys = decode(merged)
+    valid = keys[~np.isnat(keys)]
+    assert (np.diff(valid.astype(np.int64)) >= 0).all()
+    # Las fechas que no se pueden leer quedan al final
+    assert np.isnat(keys[len(valid):]).all()
+    assert len(merged) == sum(map(len, shard_dates))
+
+
+def test_merge_refuses_xlsx_over_the_row_limit(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(app, 'EXCEL_MAX_ROWS', 3)
+    rows = pd.DataFrame({'Fecha': ['2024-01-01 00:00:00', '2024-01-02 00:00:00', '2024-01-03 00:00:00']})
+    write_part(tmp_path, 'payments', 1, 0, rows)
+    base = ['merge', '--kind', 'payments', '--shards', '1', '--parts-dir', str(tmp_path)]
+
+    assert app.main_batch(base + ['--output', str(tmp_path / 'Pagos.xlsx')]) == 1
+    assert '.pkl' in capsys.readouterr().err
+    assert not (tmp_path / 'Pagos.xlsx').exists()
+
+    assert app.main_batch(base + ['--output', str(tmp_path / 'Pagos.pkl')]) == 0
+    assert len(pd.read_pickle(tmp_path / 'Pagos.pkl')) == 3
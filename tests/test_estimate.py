@@ -0,0 +1,43 @@
+"""La estimación proyecta el tiempo de un procesamiento real dentro de un margen"""
+
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+import app_sat_extractor as app
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+FILES = 4000
+# Margen frente al procesamiento real (la muestra es aleatoria y la máquina tiene ruido)
+TOLERANCE = 1.5
+
+
+class Upload(SimpleNamespace):
+    def getvalue(self):
+        return self.data
+
+
+def uploads(n):
+    texts = [path.read_bytes() for path in sorted(FIXTURES.glob('cfdi*.xml'))]
+    return [
+        Upload(name=f'{i}.xml', size=len(texts[i % len(texts)]), data=texts[i % len(texts)])
+        for i in range(n)
+    ]
+
+
+@pytest.mark.parametrize('kind', sorted(app.BATCH_PROCESSORS))
+def test_projection_matches_a_real_run(kind):
+    files = uploads(FILES)
+    estimate = app.estimate_job(kind, files, sample_size=100)
+
+    real = None
+    for _ in range(2):
+        start = time.monotonic()
+        df, _ = app.BATCH_PROCESSORS[kind](files, app.NullProgress(), app.get_parse_pool())
+        elapsed = time.monotonic() - start
+        real = elapsed if real is None else min(real, elapsed)
+
+    assert estimate['rows'] == pytest.approx(len(df), rel=0.1)
+    assert 1 / TOLERANCE <= estimate['seconds'] / real <= TOLERANCE, (estimate['seconds'], real)
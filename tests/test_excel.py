@@ -0,0 +1,36 @@
+"""Exportación a Excel: tipos y formatos de celda por columna."""
+
+from datetime import datetime
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+import app_sat_extractor as app
+
+
+def read_back(df, kind):
+    ws = load_workbook(BytesIO(app.export_excel(df, kind))).active
+    return list(ws.iter_rows(min_row=2))
+
+
+def test_invoice_cells_are_typed():
+    df = pd.DataFrame({
+        'UUID': ['A', 'B'],
+        'Fecha': ['2024-03-01 10:20:30', None],
+        'Total': [1160.0, np.nan],
+    })
+    (uuid, fecha, total), (_, sin_fecha, sin_total) = read_back(df, 'invoices')
+    assert uuid.value == 'A'
+    assert fecha.value == datetime(2024, 3, 1, 10, 20, 30)
+    assert fecha.number_format == 'yyyy-mm-dd hh:mm:ss'
+    assert total.value == 1160.0 and total.number_format == '"$"#,##0.00'
+    assert sin_fecha.value is None and sin_total.value is None
+
+
+def test_unreadable_emitted_date_keeps_its_text():
+    df = pd.DataFrame({'FECHA DD/MM/AA': ['05/01/24', '2024-13-01'], 'TOTAL': [10.0, 20.0]})
+    (fecha, _), (texto, _) = read_back(df, 'emitted_invoices')
+    assert fecha.value == datetime(2024, 1, 5) and fecha.number_format == 'dd/mm/yy'
+    assert texto.value == '2024-13-01' and texto.number_format == 'General'
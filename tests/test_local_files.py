@@ -0,0 +1,72 @@
+"""Carpetas del servidor: recorrido de la carpeta y lectura anticipada de archivos"""
+
+import os
+import threading
+
+import pytest
+
+import app_sat_extractor as app
+
+
+def write(path, data=b'<x/>'):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return path
+
+
+def test_scan_lists_xml_recursively_in_path_order(tmp_path):
+    write(tmp_path / 'b.XML')
+    write(tmp_path / 'sub' / 'dentro' / 'a.xml', b'<abc/>')
+    write(tmp_path / 'a.xml')
+    write(tmp_path / 'notas.txt')
+
+    found = app.scan_xml_directory(str(tmp_path))
+    assert [os.path.relpath(f.path, tmp_path) for f in found] == [
+        'a.xml', 'b.XML', os.path.join('sub', 'dentro', 'a.xml'),
+    ]
+    assert found[2].size == 6 and found[2].mtime > 0
+
+
+@pytest.mark.skipif(not hasattr(os, 'symlink'), reason='sin enlaces simbólicos')
+def test_scan_does_not_follow_symlinks_out_of_the_root(tmp_path):
+    root = tmp_path / 'raiz'
+    outside = write(tmp_path / 'fuera' / 'secreto.xml')
+    write(root / 'propio.xml')
+    os.symlink(outside, root / 'enlace.xml')
+    os.symlink(outside.parent, root / 'carpeta')
+
+    assert [os.path.basename(f.path) for f in app.scan_xml_directory(str(root))] == ['propio.xml']
+
+
+def test_listing_fingerprint_is_computed_once(tmp_path):
+    write(tmp_path / 'a.xml')
+    listing = app.LocalXMLListing(app.scan_xml_directory(str(tmp_path)))
+    fingerprint = app.files_fingerprint(listing)
+    assert fingerprint == app.files_fingerprint(list(listing))
+    assert listing.fingerprint == fingerprint
+
+
+def test_prefetch_keeps_order_and_returns_read_errors(tmp_path):
+    paths = [write(tmp_path / f'{i:03d}.xml', str(i).encode()) for i in range(200)]
+    files = app.scan_xml_directory(str(tmp_path))
+    paths[7].unlink()
+
+    results = list(app.iter_file_contents(files, depth=4))
+    assert [f.path for f, _ in results] == [str(p) for p in paths]
+    assert isinstance(results[7][1], OSError)
+    assert [data for _, data in results[:3]] == [b'0', b'1', b'2']
+
+
+def test_closing_prefetch_stops_the_reader(tmp_path):
+    for i in range(100):
+        write(tmp_path / f'{i:03d}.xml')
+    files = app.scan_xml_directory(str(tmp_path))
+
+    contents = app.iter_file_contents(files, depth=2)
+    next(contents)
+    contents.close()
+
+    reader = [t for t in threading.enumerate() if t.name == 'xml-prefetch']
+    for thread in reader:
+        thread.join(timeout=2)
+    assert not any(t.is_alive() for t in reader)
@@ -0,0 +1,49 @@
+"""Los parsers compilados desde ExtractionSpec no son más lentos que los escritos a mano.
+
+Se mide el mejor de varios intentos en tiempo de CPU del proceso sobre los fixtures válidos;
+el margen absorbe el ruido de la máquina, no una regresión real.
+"""
+
+import time
+from pathlib import Path
+
+import pytest
+
+import app_sat_extractor as app
+
+import original_parsers
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+TEXTS = [
+    path.read_bytes().decode('utf-8', errors='ignore')
+    for path in sorted(FIXTURES.glob('*.xml'))
+    if path.name not in ('malformado.xml', 'utf8_invalido.xml')
+]
+ORIGINAL = {
+    'facturas': original_parsers.parse_xml_invoice_one_row,
+    'pagos': original_parsers.parse_xml_payment,
+    'emitidas': original_parsers.parse_xml_emitted_invoice,
+}
+# Proporción mínima frente al parser original (1.0 sería "igual de rápido")
+MIN_RATIO = 0.9
+
+
+def best_time(call, rounds=5, repeat=200):
+    best = None
+    for _ in range(rounds):
+        start = time.process_time()
+        for _ in range(repeat):
+            for text in TEXTS:
+                call(text)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+@pytest.mark.parametrize('kind', sorted(ORIGINAL))
+def test_etree_at_least_on_par_with_original(kind):
+    backend = app.get_xml_backend('etree')
+    parse = app.XML_PARSERS[kind]
+    original = best_time(ORIGINAL[kind])
+    compiled = best_time(lambda text: parse(text, backend))
+    assert original / compiled >= MIN_RATIO, f'{kind}: {original / compiled:.2f}x del original'
@@ -0,0 +1,36 @@
+"""Los parsers declarativos reproducen la salida de los parsers escritos a mano originales.
+
+salida_original.json se generó una vez con los parsers anteriores a ExtractionSpec sobre
+el texto decodificado de cada fixture (como se leían entonces); el orden de columnas
+también debe coincidir porque define el orden del DataFrame.
+"""
+
+import json
+from pathlib import Path
+
+import pytest
+
+import app_sat_extractor as app
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+EXPECTED = json.loads((FIXTURES / 'salida_original.json').read_text(encoding='utf-8'))
+
+BACKENDS = ['etree'] + (['lxml'] if app.LET is not None else [])
+
+
+def ordered(value):
+    if isinstance(value, dict):
+        return list(value.items())
+    if isinstance(value, list):
+        return [ordered(v) for v in value]
+    return value
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('kind', sorted(app.XML_PARSERS))
+@pytest.mark.parametrize('fixture', sorted(EXPECTED))
+def test_matches_original_parsers(fixture, kind, backend):
+    text = (FIXTURES / fixture).read_bytes().decode('utf-8', errors='ignore')
+    got = app.XML_PARSERS[kind](text, app.get_xml_backend(backend))
+    assert ordered(got) == ordered(EXPECTED[fixture][kind])
+
@@ -0,0 +1,94 @@
+"""Pipeline de parseo: orden, errores como resultados y cancelación al cerrar el generador"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+import app_sat_extractor as app
+
+
+class Upload(SimpleNamespace):
+    def getvalue(self):
+        if isinstance(self.data, Exception):
+            raise self.data
+        return self.data
+
+
+def uploads(n):
+    return [Upload(name=f'{i}.xml', size=1, data=str(i).encode()) for i in range(n)]
+
+
+@pytest.fixture(params=['pool', 'inline'])
+def pool(request):
+    if request.param == 'inline':
+        yield None
+        return
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        yield executor
+
+
+@pytest.fixture(autouse=True)
+def inline_by_default(monkeypatch):
+    # Sin pool explícito se parsea en línea, sin depender del backend instalado
+    monkeypatch.setattr(app, 'get_parse_pool', lambda: None)
+
+
+def test_results_keep_file_order(pool):
+    rng = random.Random(0)
+
+    def parse(raw):
+        # Demoras distintas para que los futures terminen fuera de orden
+        time.sleep(rng.random() / 1000)
+        return int(raw)
+
+    files = uploads(300)
+    results = list(app.iter_parsed_files(files, parse, pool))
+    assert [f for f, _ in results] == files
+    assert [r for _, r in results] == list(range(300))
+
+
+def test_read_and_parse_errors_are_results(pool):
+    files = uploads(5)
+    files[1].data = OSError('sin permiso')
+
+    def parse(raw):
+        if raw == b'3':
+            raise ValueError('XML inválido')
+        return raw
+
+    results = [r for _, r in app.iter_parsed_files(files, parse, pool)]
+    assert isinstance(results[1], OSError) and str(results[1]) == 'sin permiso'
+    assert isinstance(results[3], ValueError)
+    assert results[0] == b'0' and results[4] == b'4'
+
+
+def test_closing_cancels_pending_parses(monkeypatch):
+    monkeypatch.setattr(app, 'PARSE_WINDOW', 4)
+    running, release = threading.Event(), threading.Event()
+    parsed = []
+
+    def parse(raw):
+        parsed.append(raw)
+        if raw != b'0':
+            running.set()
+            release.wait(5)
+        return raw
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        results = app.iter_parsed_files(uploads(50), parse, executor)
+        assert next(results)[1] == b'0'
+        running.wait(5)
+        results.close()
+        release.set()
+    # Solo corrieron el primero y el que ya estaba en ejecución al cerrar
+    assert parsed == [b'0', b'1']
+
+
+def test_etree_parses_without_threads():
+    assert app.EtreeBackend.releases_gil is False
+    if not app.XML.releases_gil:
+        assert not app.PARSE_IN_THREADS and app.new_parse_pool() is None
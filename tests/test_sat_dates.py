@@ -0,0 +1,40 @@
+"""El decodificador en bloque y el de un solo valor aceptan y rechazan las mismas fechas"""
+
+import numpy as np
+import pytest
+
+import app_sat_extractor as app
+
+VALID = ['2024-01-31T23:59:59', '1999-12-01T00:00:00', '2024-02-29T12:00:00']
+INVALID = [
+    '+024-01-01T00:00:00', ' 024-01-01T00:00:00', '2024-1-01T00:00:00 ', '2024-01-01 00:00:00',
+    '2024-13-01T00:00:00', '2023-02-29T00:00:00', '2024-01-01T24:00:00', '٢٠٢٤-01-01T00:00:00',
+    '2024-01-01', '', None, 20240101, '0000-01-01T00:00:00',
+]
+
+
+def test_shape_and_calendar_edges_agree():
+    # Todas las combinaciones de años, meses, días y horas límite, no solo las listadas arriba
+    values = [
+        f'{y}-{mo}-{d}T{h}:{mi}:{s}'
+        for y in ('0000', '0001', '1970', '2024', '9999') for mo in ('00', '01', '02', '12', '13')
+        for d in ('00', '01', '29', '30', '31', '32') for h in ('00', '23', '24')
+        for mi in ('00', '59', '60') for s in ('00', '59', '60')
+    ]
+    _, invalid = app.parse_sat_dates(values)
+    assert invalid == [i for i, v in enumerate(values) if app.parse_sat_datetime(v) is None]
+
+
+@pytest.mark.parametrize('value', VALID + INVALID)
+def test_bulk_agrees_with_scalar(value):
+    dates, invalid = app.parse_sat_dates([value])
+    scalar = app.parse_sat_datetime(value)
+    assert (invalid == [0]) == (scalar is None)
+    if scalar is not None:
+        assert dates[0] == np.datetime64(scalar, 's')
+
+
+def test_bulk_mixed():
+    dates, invalid = app.parse_sat_dates(VALID + INVALID)
+    assert invalid == list(range(len(VALID), len(VALID) + len(INVALID)))
+    assert app.format_sat_dates(dates)[:len(VALID)] == [v.replace('T', ' ') for v in VALID]
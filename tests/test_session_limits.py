@@ -0,0 +1,30 @@
+"""Límites por sesión: los archivos subidos cuentan, las carpetas del servidor no"""
+
+from types import SimpleNamespace
+
+import app_sat_extractor as app
+
+
+def uploaded(size):
+    return SimpleNamespace(name='subido.xml', size=size)
+
+
+def local(size):
+    return app.LocalXMLFile('/datos/xml/local.xml', size)
+
+
+def test_upload_file_count_limit(monkeypatch):
+    monkeypatch.setattr(app, 'MAX_FILES_PER_SESSION', 3)
+    assert app.check_session_limits([uploaded(100)] * 3) is None
+    assert 'máximo por sesión es 3' in app.check_session_limits([uploaded(100)] * 4)
+
+
+def test_local_files_are_not_capped_by_upload_limits(monkeypatch):
+    monkeypatch.setattr(app, 'MAX_FILES_PER_SESSION', 3)
+    monkeypatch.setattr(app, 'MAX_MB_PER_SESSION', 1)
+    assert app.check_session_limits([local(512 * 1024)] * 1000) is None
+
+
+def test_memory_limit_still_applies_to_local_files(monkeypatch):
+    monkeypatch.setattr(app, 'MAX_MEMORY_MB_PER_SESSION', 1)
+    assert 'memoria' in app.check_session_limits([local(1024 * 1024)])
@@ -0,0 +1,90 @@
+"""Cola compartida: turnos entre sesiones, posición en cola y limpieza de tickets"""
+
+import threading
+import time
+
+import pytest
+
+import app_sat_extractor as app
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('la condición no se cumplió a tiempo')
+        time.sleep(0.01)
+
+
+def queued(scheduler):
+    with scheduler._cond:
+        return sum(len(tickets) for tickets in scheduler._waiting.values())
+
+
+def test_slots_are_shared_by_two_sessions():
+    scheduler = app.WorkScheduler(2)
+    both_running = threading.Barrier(2, timeout=5)
+
+    def job(session_id):
+        with scheduler.acquire(session_id):
+            both_running.wait()
+
+    threads = [threading.Thread(target=job, args=(s,)) for s in ('a', 'b')]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=5)
+    assert not both_running.broken
+    assert not scheduler._granted and not scheduler._waiting
+
+
+def test_waiters_get_turns_round_robin_and_see_their_position():
+    scheduler = app.WorkScheduler(1)
+    granted, positions = [], {}
+
+    def job(name, session_id):
+        def on_wait(position):
+            positions.setdefault(name, position)
+
+        with scheduler.acquire(session_id, on_wait):
+            granted.append(name)
+
+    holder = scheduler.acquire('a')
+    holder.__enter__()
+    threads = []
+    # La sesión b encola dos trabajos antes que a y c: no debe acaparar los turnos
+    for name, session_id in (('b1', 'b'), ('b2', 'b'), ('a2', 'a'), ('c1', 'c')):
+        t = threading.Thread(target=job, args=(name, session_id))
+        t.start()
+        threads.append(t)
+        wait_until(lambda: queued(scheduler) == len(threads))
+
+    wait_until(lambda: len(positions) == 4)
+    holder.__exit__(None, None, None)
+    for t in threads:
+        t.join(timeout=5)
+
+    assert positions == {'b1': 0, 'a2': 1, 'c1': 2, 'b2': 3}
+    assert granted == ['b1', 'a2', 'c1', 'b2']
+    assert not scheduler._granted and not scheduler._waiting
+
+
+def test_interrupted_waiter_leaves_the_queue():
+    scheduler = app.WorkScheduler(1)
+
+    class Rerun(Exception):
+        pass
+
+    def on_wait(position):
+        # Streamlit interrumpe el script con una excepción en un rerun o desconexión
+        raise Rerun
+
+    with scheduler.acquire('a'):
+        with pytest.raises(Rerun):
+            with scheduler.acquire('b', on_wait):
+                pass
+        assert not scheduler._waiting
+
+    assert not scheduler._granted
+    with scheduler.acquire('c'):
+        assert len(scheduler._granted) == 1